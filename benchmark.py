@@ -0,0 +1,296 @@
+"""Benchmark sem interface do Fitesa Mobile.
+
+Roda o main(page) de verdade contra uma Page do Flet ligada a uma conexão falsa
+(nenhum cliente Flutter), com bancos SQLite populados com dados sintéticos, e
+mede as telas e o caminho do relatório.
+
+Uso:
+    python benchmark.py --tamanhos 10 100 1000 --repeticoes 20 --saida benchmark.json
+
+O resultado é um JSON com percentis de latência (ms), pico de memória Python
+(tracemalloc) e quantidade de comandos enviados ao cliente por operação, para
+comparar versões.
+"""
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import flet as ft
+from flet.core.connection import Connection
+from flet.core.protocol import PageCommandResponsePayload, PageCommandsBatchResponsePayload
+
+import main as app
+
+
+# ==============================================================================
+# PAGE FALSA
+# ==============================================================================
+class ConexaoFalsa(Connection):
+    """Responde aos comandos como o cliente Flutter faria, sem desenhar nada."""
+
+    def __init__(self):
+        super().__init__()
+        self._proximo_id = 1
+        self.comandos = 0
+
+    def send_command(self, session_id, command):
+        self.comandos += 1
+        return PageCommandResponsePayload(result="", error="")
+
+    def send_commands(self, session_id, commands):
+        resultados = []
+        for cmd in commands:
+            self.comandos += 1 + len(cmd.commands)
+            if cmd.name == "add":
+                ids = []
+                for _ in cmd.commands:
+                    ids.append(f"_{self._proximo_id}")
+                    self._proximo_id += 1
+                resultados.append(" ".join(ids))
+        return PageCommandsBatchResponsePayload(results=resultados, error="")
+
+
+class PaginaBenchmark(ft.Page):
+    """Page real do Flet: o diff e a serialização dos controles são medidos de verdade."""
+
+    def __init__(self):
+        self.conexao = ConexaoFalsa()
+        super().__init__(self.conexao, "benchmark", asyncio.new_event_loop())
+        self.abertos = []
+
+    def open(self, control):
+        self.abertos.append(control)
+        super().open(control)
+
+    def run_thread(self, handler, *args, **kwargs):
+        # Síncrono de propósito: o tempo do gerar_pdf inclui o trabalho da thread
+        handler(*args, **kwargs)
+
+
+def percorrer(control):
+    yield control
+    for filho in control._get_children():
+        yield from percorrer(filho)
+
+
+def encontrar(page, tipo, filtro=lambda c: True):
+    return [c for c in percorrer(page) if isinstance(c, tipo) and filtro(c)]
+
+
+def evento(**kw):
+    return SimpleNamespace(**kw)
+
+
+# ==============================================================================
+# DADOS SINTÉTICOS
+# ==============================================================================
+def popular_banco(caminho, n_itens, n_rascunhos, n_historico, seed=42):
+    rnd = random.Random(seed)
+    conexao = sqlite3.connect(caminho)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    app.migrar(conexao)
+    with conexao:
+        for tipo, qtd in (("lider", 30), ("maquina", 40), ("turma", 5), ("rota", 20)):
+            conexao.executemany("INSERT INTO opcoes (tipo, nome) VALUES (?, ?)",
+                                [(tipo, f"{tipo.title()} {i:03d}") for i in range(qtd)])
+        titulos = [f"Item {i:04d} - verificar componente" for i in range(n_itens)]
+        conexao.executemany("INSERT INTO rotina_itens (titulo, ordem) VALUES (?, ?)",
+                            [(t, (i + 1) * app.ORDEM_PASSO) for i, t in enumerate(titulos)])
+        rascunho = {"lider": "Lider 001", "maquina": "Maquina 002", "turma": "Turma 001",
+                    "rota": "Rota 003", "data": "01/01/2026"}
+        for item_id, in conexao.execute("SELECT id FROM rotina_itens"):
+            if rnd.random() < 0.5:
+                rascunho[f"obs_{item_id}"] = "vazamento leve no rolamento " * rnd.randint(1, 4)
+        # Rascunhos órfãos de itens antigos completam o volume pedido
+        for i in range(max(0, n_rascunhos - len(rascunho))):
+            rascunho[f"obs_{n_itens + 1 + i}"] = "texto antigo"
+        conexao.executemany("INSERT INTO rascunho (id, valor) VALUES (?, ?)", list(rascunho.items()))
+        inicio = datetime.date(2024, 1, 1)
+        conexao.executemany("INSERT INTO historico (data, info, turma) VALUES (?, ?, ?)", [
+            ((inicio + datetime.timedelta(days=i // 3)).isoformat(), f"relatorio_{i}.pdf", f"Turma {i % 3:03d}")
+            for i in range(n_historico)])
+    conexao.close()
+
+
+# ==============================================================================
+# MEDIÇÃO
+# ==============================================================================
+def medir(nome, funcao, repeticoes, page, preparar=None):
+    tempos = []
+    comandos = []
+    gc.collect()
+    for _ in range(repeticoes):
+        if preparar:
+            preparar()
+        antes = page.conexao.comandos
+        t0 = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - t0) * 1000)
+        comandos.append(page.conexao.comandos - antes)
+    # Memória numa execução à parte: o tracemalloc distorce bastante os tempos
+    if preparar:
+        preparar()
+    tracemalloc.start()
+    funcao()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"operacao": nome, **resumo(tempos), "pico_memoria_kb": round(pico / 1024, 1),
+            "comandos_cliente": round(statistics.mean(comandos), 1)}
+
+
+def resumo(tempos):
+    ordenados = sorted(tempos)
+
+    def pct(p):
+        return round(ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))], 3)
+
+    return {"n": len(tempos), "media_ms": round(statistics.mean(tempos), 3),
+            "p50_ms": pct(50), "p90_ms": pct(90), "p99_ms": pct(99), "max_ms": round(ordenados[-1], 3)}
+
+
+def executar_cenario(n_itens, args):
+    pasta = tempfile.mkdtemp(prefix=f"fitesa_bench_{n_itens}_")
+    try:
+        os.environ["HOME"] = pasta
+        caminho = os.path.join(pasta, "fitesa_rotas.db")
+        popular_banco(caminho, n_itens, args.rascunhos, args.historico)
+
+        page = PaginaBenchmark()
+        t0 = time.perf_counter()
+        app.main(page)
+        resultados = [{"operacao": "inicializacao", **resumo([(time.perf_counter() - t0) * 1000]),
+                       "pico_memoria_kb": None, "comandos_cliente": page.conexao.comandos}]
+
+        # Login pela tela, como o usuário faria
+        usuario, senha = encontrar(page, ft.TextField)[:2]
+        usuario.value, senha.value = "admin", "admin"
+        encontrar(page, ft.ElevatedButton, lambda c: c.text == "ACESSAR")[0].on_click(evento())
+        navegar = page.navigation_bar.on_change
+
+        def ir_para(indice):
+            navegar(evento(control=evento(selected_index=indice)))
+
+        def rota_completa():
+            # Abre a rota e rola até o fim, montando todas as páginas do checklist
+            ir_para(1)
+            lista = encontrar(page, ft.ListView)[0]
+            while True:
+                montados = len(lista.controls)
+                lista.on_scroll(evento(pixels=1000, max_scroll_extent=1000))
+                if len(lista.controls) == montados:
+                    break
+
+        resultados.append(medir("show_rota", lambda: ir_para(1), args.repeticoes, page))
+        resultados.append(medir("show_rota_rolagem_completa", rota_completa, max(1, args.repeticoes // 4), page))
+
+        # Rajada de digitação numa observação + flush do lote
+        ir_para(1)
+        campo = encontrar(page, ft.TextField, lambda c: c.hint_text == "Obs...")
+        if campo:
+            campo = campo[0]
+            texto = "rolamento com ruido e vazamento de oleo na saida " * 4
+
+            def rajada():
+                for i in range(1, len(texto) + 1):
+                    campo.value = texto[:i]
+                    campo.on_change(evento(control=campo))
+
+            resultados.append(medir("save_draft_rajada", rajada, args.repeticoes, page))
+            def sujar():
+                campo.value = str(random.random())
+                campo.on_change(evento(control=campo))
+
+            resultados.append(medir("save_draft_flush", app.sessoes[page.session_id].flush, args.repeticoes, page, preparar=sujar))
+
+        # Administração: senha no diálogo e aba do checklist
+        def abrir_admin():
+            ir_para(3)
+            dlg = page.abertos[-1]
+            dlg.content.value = "production26"
+            dlg.actions[0].on_click(evento())
+
+        resultados.append(medir("show_historico", lambda: ir_para(2), args.repeticoes, page))
+        resultados.append(medir("show_admin", abrir_admin, args.repeticoes, page))
+
+        alvos = encontrar(page, ft.DragTarget)
+        if len(alvos) >= 2:
+            rnd = random.Random(7)
+
+            def arrastar():
+                origem, alvo = rnd.sample(alvos, 2)
+                alvo.on_accept(evento(src_id=origem.content.uid, data="", control=alvo))
+
+            resultados.append(medir("drag_accept", arrastar, args.repeticoes, page))
+
+        if app.fpdf_disponivel():
+            ir_para(1)
+            finalizar = encontrar(page, ft.ElevatedButton, lambda c: c.text == "Finalizar PDF")[0]
+            resultados.append(medir("gerar_pdf", lambda: finalizar.on_click(evento()), max(1, args.repeticoes // 4), page))
+
+        cenario = {"itens": n_itens, "rascunhos": args.rascunhos, "historico": args.historico, "resultados": resultados}
+        if app.diagnostico.ativo:
+            cenario["diagnostico"] = app.diagnostico.instantaneo()
+            app.diagnostico.zerar()
+
+        # Fecha banco e sessões: o próximo cenário abre outro HOME
+        app.encerrar()
+        return cenario
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[10, 100, 1000], help="itens do checklist por cenário")
+    parser.add_argument("--rascunhos", type=int, default=5000, help="linhas na tabela rascunho")
+    parser.add_argument("--historico", type=int, default=20000, help="linhas na tabela historico")
+    parser.add_argument("--repeticoes", type=int, default=20)
+    parser.add_argument("--saida", default="benchmark.json")
+    parser.add_argument("--diagnostico", action="store_true", help="liga a instrumentação do app e inclui o instantâneo no JSON")
+    args = parser.parse_args()
+    app.diagnostico.ativo = args.diagnostico
+
+    cenarios = []
+    for n in args.tamanhos:
+        print(f"cenario {n} itens...", file=sys.stderr)
+        cenarios.append(executar_cenario(n, args))
+
+    try:
+        import resource
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        rss_kb = None
+
+    saida = {
+        "versao_app": app.APP_VERSAO,
+        "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "plataforma": platform.platform(),
+        "pico_rss_kb": rss_kb,
+        "cenarios": cenarios,
+    }
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(saida, f, ensure_ascii=False, indent=2)
+
+    for c in cenarios:
+        for r in c["resultados"]:
+            print(f"{c['itens']:>6} itens  {r['operacao']:<28} p50 {r['p50_ms']:>9.2f} ms  p99 {r['p99_ms']:>9.2f} ms")
+    print(f"resultado gravado em {args.saida}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Coletor central da sincronização do Fitesa Mobile.
+
+Servidor HTTP simples (só biblioteca padrão) que recebe as alterações de cada
+tablet, guarda o log na ordem de chegada e devolve aos outros aparelhos as
+alterações de configuração (checklist e opções). Mantém também a versão mais
+recente de cada registro, inclusive das rotas finalizadas, e as fotos.
+
+Uso:
+    python coletor.py --porta 8765 --pasta coletor_dados
+
+No tablet, o endereço (http://<máquina>:8765) vai na aba "Sinc." do admin ou
+na variável FITESA_COLETOR.
+
+Rotas:
+    POST /sync/push        {"dispositivo", "alteracoes": [...]}  (gzip)
+    GET  /sync/pull        ?desde=<seq>&dispositivo=<id>&limite=<n>
+    POST /fotos/faltando   {"hashes": [...]} -> {"faltando": [...]}
+    PUT  /fotos/<hash>     conteúdo do JPEG
+    GET  /status
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Tabelas que os tablets recebem de volta (as rotas só sobem)
+TABELAS_DISTRIBUIDAS = ("opcoes", "rotina_itens")
+LIMITE_MAX = 2000
+HASH_VALIDO = re.compile(r"^[0-9a-f]{64}$")
+
+
+# ==============================================================================
+# ARMAZENAMENTO
+# ==============================================================================
+class Coletor:
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.pasta_fotos = os.path.join(pasta, "fotos")
+        os.makedirs(self.pasta_fotos, exist_ok=True)
+        self._conexao = sqlite3.connect(os.path.join(pasta, "coletor.db"), check_same_thread=False, isolation_level=None)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        with self._lock:
+            c = self._conexao
+            c.execute("""CREATE TABLE IF NOT EXISTS alteracoes (
+                seq INTEGER PRIMARY KEY, dispositivo TEXT NOT NULL, seq_origem INTEGER NOT NULL,
+                tabela TEXT NOT NULL, uid TEXT NOT NULL, operacao TEXT NOT NULL, alterado_em TEXT NOT NULL,
+                dados TEXT, UNIQUE (dispositivo, seq_origem))""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_alteracoes_tabela ON alteracoes (tabela, seq)")
+            # Última versão de cada registro (o mais recente vence), para consulta
+            c.execute("""CREATE TABLE IF NOT EXISTS registros (
+                tabela TEXT NOT NULL, uid TEXT NOT NULL, dispositivo TEXT, alterado_em TEXT NOT NULL,
+                apagado INTEGER NOT NULL DEFAULT 0, dados TEXT, PRIMARY KEY (tabela, uid))""")
+
+    def receber(self, dispositivo, alteracoes):
+        with self._lock:
+            c = self._conexao
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                novas = 0
+                for a in alteracoes:
+                    dados = json.dumps(a.get("dados"), ensure_ascii=False) if a.get("dados") is not None else None
+                    # (dispositivo, seq_origem) único: reenvio de um lote sem resposta não duplica nada
+                    cur = c.execute("INSERT OR IGNORE INTO alteracoes (dispositivo, seq_origem, tabela, uid, operacao, alterado_em, dados) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (dispositivo, a["seq"], a["tabela"], a["uid"], a["operacao"], a["alterado_em"], dados))
+                    if not cur.rowcount:
+                        continue
+                    novas += 1
+                    c.execute("""INSERT INTO registros (tabela, uid, dispositivo, alterado_em, apagado, dados) VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (tabela, uid) DO UPDATE SET dispositivo = excluded.dispositivo, alterado_em = excluded.alterado_em,
+                            apagado = excluded.apagado, dados = excluded.dados
+                        WHERE excluded.alterado_em >= registros.alterado_em""",
+                              (a["tabela"], a["uid"], dispositivo, a["alterado_em"], int(a["operacao"] == "apagar"), dados))
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+        return novas
+
+    def entregar(self, desde, dispositivo, limite):
+        marcadores = ",".join("?" * len(TABELAS_DISTRIBUIDAS))
+        with self._lock:
+            c = self._conexao
+            # Teto lido antes: o cursor devolvido nunca pula uma alteração que chegou no meio
+            teto = c.execute("SELECT COALESCE(MAX(seq), 0) FROM alteracoes").fetchone()[0]
+            linhas = c.execute(
+                f"SELECT seq, tabela, uid, operacao, alterado_em, dados FROM alteracoes "
+                f"WHERE seq > ? AND seq <= ? AND dispositivo <> ? AND tabela IN ({marcadores}) ORDER BY seq LIMIT ?",
+                (desde, teto, dispositivo, *TABELAS_DISTRIBUIDAS, limite)).fetchall()
+        mais = len(linhas) == limite
+        return {
+            "alteracoes": [{"tabela": t, "uid": u, "operacao": o, "alterado_em": q, "dados": json.loads(d) if d else None}
+                           for _, t, u, o, q, d in linhas],
+            "ate": linhas[-1][0] if mais else max(teto, desde),
+            "mais": mais,
+        }
+
+    def faltando(self, hashes):
+        return [h for h in hashes if HASH_VALIDO.match(h) and not os.path.exists(self.caminho_foto(h))]
+
+    def caminho_foto(self, digest):
+        return os.path.join(self.pasta_fotos, f"{digest}.jpg")
+
+    def status(self):
+        with self._lock:
+            contagem = dict(self._conexao.execute(
+                "SELECT tabela, COUNT(*) FROM registros WHERE apagado = 0 GROUP BY tabela").fetchall())
+            dispositivos = self._conexao.execute("SELECT COUNT(DISTINCT dispositivo) FROM alteracoes").fetchone()[0]
+        return {"registros": contagem, "dispositivos": dispositivos, "fotos": len(os.listdir(self.pasta_fotos))}
+
+
+# ==============================================================================
+# HTTP
+# ==============================================================================
+class Tratador(BaseHTTPRequestHandler):
+    coletor = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        sys.stderr.write(f"[coletor] {self.address_string()} {formato % args}\n")
+
+    def _corpo(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        dados = self.rfile.read(tamanho) if tamanho else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            dados = gzip.decompress(dados)
+        return dados
+
+    def _responder(self, codigo, corpo):
+        dados = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        comprimir = "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if comprimir:
+            dados = gzip.compress(dados)
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        if comprimir:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/sync/pull":
+            q = parse_qs(url.query)
+            try:
+                desde = int(q.get("desde", ["0"])[0])
+                limite = min(LIMITE_MAX, max(1, int(q.get("limite", ["500"])[0])))
+            except ValueError:
+                return self._responder(400, {"erro": "parametros invalidos"})
+            return self._responder(200, self.coletor.entregar(desde, q.get("dispositivo", [""])[0], limite))
+        if url.path == "/status":
+            return self._responder(200, self.coletor.status())
+        self._responder(404, {"erro": "rota desconhecida"})
+
+    def do_POST(self):
+        try:
+            corpo = json.loads(self._corpo() or b"{}")
+        except (OSError, ValueError):
+            return self._responder(400, {"erro": "corpo invalido"})
+        if self.path == "/sync/push":
+            if not corpo.get("dispositivo"):
+                return self._responder(400, {"erro": "dispositivo ausente"})
+            try:
+                novas = self.coletor.receber(corpo["dispositivo"], corpo.get("alteracoes", []))
+            except (KeyError, TypeError) as ex:
+                return self._responder(400, {"erro": f"alteracao invalida: {ex}"})
+            return self._responder(200, {"recebidas": novas})
+        if self.path == "/fotos/faltando":
+            return self._responder(200, {"faltando": self.coletor.faltando(corpo.get("hashes", []))})
+        self._responder(404, {"erro": "rota desconhecida"})
+
+    def do_PUT(self):
+        digest = self.path.rsplit("/", 1)[-1]
+        if not self.path.startswith("/fotos/") or not HASH_VALIDO.match(digest):
+            return self._responder(404, {"erro": "rota desconhecida"})
+        dados = self._corpo()
+        destino = self.coletor.caminho_foto(digest)
+        # Grava inteiro ou nada: um envio interrompido é simplesmente refeito
+        temporario = f"{destino}.{threading.get_ident()}.tmp"
+        with open(temporario, "wb") as f:
+            f.write(dados)
+        os.replace(temporario, destino)
+        self._responder(200, {"bytes": len(dados)})
+
+
+def criar_servidor(pasta, porta=8765, host="0.0.0.0"):
+    tratador = type("TratadorColetor", (Tratador,), {"coletor": Coletor(pasta)})
+    return ThreadingHTTPServer((host, porta), tratador)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--pasta", default="coletor_dados", help="onde ficam coletor.db e as fotos")
+    args = parser.parse_args()
+
+    servidor = criar_servidor(args.pasta, args.porta, args.host)
+    print(f"coletor em http://{args.host}:{args.porta} (dados em {args.pasta})", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
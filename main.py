@@ -5,20 +5,1877 @@ import os
 import sys
 import traceback
 import time
+import threading
+import atexit
+import hashlib
+import importlib.util
+import queue
+import uuid
+import re
+import json
+import csv
+import shutil
+import tempfile
+import gzip
+import urllib.parse
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future
 
 # --- CONFIGURAÇÃO INICIAL E SEGURANÇA ---
-try:
-    from fpdf import FPDF
-    fpdf_disponivel = True
-except ImportError:
-    fpdf_disponivel = False
+APP_VERSAO = "1.1.0"
+
+def fpdf_disponivel():
+    # Só verifica se o pacote existe; o import de verdade fica para quando um PDF é pedido
+    return importlib.util.find_spec("fpdf") is not None
 
-# Variáveis globais para conexão
-conn = None
-cursor = None
+# Modo servidor: várias sessões (líderes) no mesmo processo via Flet web
+MODO_SERVIDOR = os.environ.get("FITESA_SERVIDOR") == "1"
+
+# Variáveis globais (compartilhadas por todas as sessões do processo)
+banco = None
 db_path = ""
+fotos = None
+catalogo = None
+manutencao = None
+sincronizador = None
+sessoes = {}  # page.session_id -> RascunhoStore da sessão
+_init_lock = threading.Lock()
+
+# Quantidade de itens do checklist montados por vez na tela da rota
+PAGINA_CHECKLIST = 30
+# Linhas do histórico buscadas por página
+PAGINA_HISTORICO = 30
+# Medições de abertura guardadas em metricas_inicio (as mais antigas são descartadas)
+METRICAS_INICIO_MAX = 500
+
+# --- ORDEM DO CHECKLIST (RANKS COM INTERVALO) ---
+# Cada item recebe um rank com folga de ORDEM_PASSO para o próximo. Mover um item
+# grava só a linha movida (rank no meio do intervalo); quando o intervalo acaba a
+# lista é renumerada uma vez e volta a ter folga.
+ORDEM_PASSO = 1024
+
+def proxima_ordem(c):
+    res = c.execute("SELECT MAX(ordem) FROM rotina_itens").fetchone()
+    return (res[0] or 0) + ORDEM_PASSO
+
+def rebalancear_ordem(c):
+    ids = [r[0] for r in c.execute("SELECT id FROM rotina_itens ORDER BY ordem ASC, id ASC").fetchall()]
+    c.executemany("UPDATE rotina_itens SET ordem = ? WHERE id = ?", [((i + 1) * ORDEM_PASSO, i_id) for i, i_id in enumerate(ids)])
+
+def mover_item_rotina(c, src_id, tgt_id):
+    """Coloca src_id imediatamente antes de tgt_id. Não faz commit."""
+    for _ in range(2):
+        alvo = c.execute("SELECT ordem FROM rotina_itens WHERE id = ?", (tgt_id,)).fetchone()
+        if not alvo or not c.execute("SELECT 1 FROM rotina_itens WHERE id = ?", (src_id,)).fetchone():
+            return False
+        # Comparação por valor de linha: uma busca só no índice (ordem, id), sem ordenar
+        anterior = c.execute(
+            "SELECT ordem FROM rotina_itens WHERE (ordem, id) < (?, ?) AND id <> ? "
+            "ORDER BY ordem DESC, id DESC LIMIT 1", (alvo[0], tgt_id, src_id)).fetchone()
+        baixo = anterior[0] if anterior else alvo[0] - 2 * ORDEM_PASSO
+        if alvo[0] - baixo >= 2:
+            c.execute("UPDATE rotina_itens SET ordem = ? WHERE id = ?", ((baixo + alvo[0]) // 2, src_id))
+            return True
+        rebalancear_ordem(c)
+    return False
+
+# --- DIAGNÓSTICO (CONSULTAS, TELAS E OPERAÇÕES LENTAS) ---
+class Diagnostico:
+    """Medições de desempenho do processo, exibidas na aba Diagnóstico do admin.
+
+    Desligado, cada ponto medido custa só a leitura de `ativo`. Ligado, guarda por
+    (tipo, nome) a quantidade, o tempo total e o máximo; o tamanho da árvore de
+    controles deixada por cada tela; e as últimas operações lentas e erros.
+    """
+
+    LIMITE_LENTO_MS = 50
+    MAX_LENTAS = 200
+
+    def __init__(self, ativo=False):
+        self.ativo = ativo
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self._medidas = {}   # (tipo, nome) -> [quantidade, total_ms, max_ms]
+            self._arvores = {}   # tela -> quantidade de controles
+            self._lentas = deque(maxlen=self.MAX_LENTAS)
+            self._desde = time.time()
+
+    def registrar(self, tipo, nome, ms):
+        with self._lock:
+            m = self._medidas.get((tipo, nome))
+            if m is None:
+                self._medidas[(tipo, nome)] = [1, ms, ms]
+            else:
+                m[0] += 1
+                m[1] += ms
+                if ms > m[2]:
+                    m[2] = ms
+            if ms >= self.LIMITE_LENTO_MS:
+                self._lentas.append({"quando": time.time(), "tipo": tipo, "nome": nome, "ms": round(ms, 1)})
+
+    def sql(self, comando, ms):
+        # Espaços normalizados e listas de "?" encurtadas: o mesmo comando cai na mesma chave
+        chave = re.sub(r"\?(\s*,\s*\?)+", "?,...", " ".join(comando.split()))
+        self.registrar("sql", chave, ms)
+
+    def erro(self, nome, ex):
+        with self._lock:
+            self._lentas.append({"quando": time.time(), "tipo": "erro", "nome": nome, "ms": 0,
+                                 "detalhe": f"{type(ex).__name__}: {ex}"})
+
+    def arvore(self, tela, raiz):
+        n, pilha = 0, [raiz]
+        while pilha:
+            controle = pilha.pop()
+            n += 1
+            pilha.extend(controle._get_children())
+        with self._lock:
+            self._arvores[tela] = n
+
+    def tela(self, page, funcao):
+        """Envolve uma show_*: tempo de montagem e tamanho da árvore que ela deixa na página."""
+        nome = funcao.__name__
+
+        def medida(*args, **kw):
+            if not self.ativo:
+                return funcao(*args, **kw)
+            t0 = time.perf_counter()
+            try:
+                return funcao(*args, **kw)
+            except Exception as ex:
+                self.erro(nome, ex)
+                raise
+            finally:
+                self.registrar("tela", nome, (time.perf_counter() - t0) * 1000)
+                self.arvore(nome, page)
+        return medida
+
+    def instantaneo(self):
+        with self._lock:
+            medidas = [{"tipo": t, "nome": n, "quantidade": q, "total_ms": round(total, 3),
+                        "media_ms": round(total / q, 3), "max_ms": round(maximo, 3)}
+                       for (t, n), (q, total, maximo) in self._medidas.items()]
+            arvores = dict(self._arvores)
+            lentas = list(self._lentas)
+            desde = self._desde
+        medidas.sort(key=lambda m: m["total_ms"], reverse=True)
+        return {
+            "versao_app": APP_VERSAO,
+            "ativo": self.ativo,
+            "desde": datetime.datetime.fromtimestamp(desde).isoformat(timespec="seconds"),
+            "gerado": datetime.datetime.now().isoformat(timespec="seconds"),
+            "medidas": medidas,
+            "arvores": arvores,
+            "lentas": [{**l, "quando": datetime.datetime.fromtimestamp(l["quando"]).isoformat(timespec="seconds")} for l in lentas],
+        }
+
+    def exportar(self, caminho):
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(self.instantaneo(), f, ensure_ascii=False, indent=2)
+        return caminho
+
+diagnostico = Diagnostico(ativo=os.environ.get("FITESA_DIAGNOSTICO") == "1")
+
+class CursorMedido:
+    """Cronometra cada comando (só com diagnóstico ligado).
+
+    Envolve o cursor da thread de escrita ou uma conexão de leitura do pool: a
+    conexão devolve um cursor novo a cada execute, que sai medido também.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _medir(self, metodo, sql, parametros):
+        t0 = time.perf_counter()
+        try:
+            resultado = metodo(sql, parametros)
+        finally:
+            diagnostico.sql(sql, (time.perf_counter() - t0) * 1000)
+        return self if resultado is self._cursor else CursorMedido(resultado)
+
+    def execute(self, sql, params=()):
+        return self._medir(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, linhas):
+        return self._medir(self._cursor.executemany, sql, linhas)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+# --- BANCO: POOL DE LEITURA + ESCRITOR ÚNICO ---
+class BancoSQLite:
+    """Acesso ao SQLite compartilhado por todas as sessões.
+
+    Leituras usam um pool de conexões (em WAL não bloqueiam a escrita). Escritas
+    entram numa fila atendida por uma única thread, que junta as tarefas
+    pendentes numa só transação (group commit): como só existe um escritor, as
+    sessões nunca disputam o lock do banco.
+    """
+
+    LOTE_MAX = 64
+
+    def __init__(self, caminho, leitores=4):
+        self.caminho = caminho
+        self._leitores = queue.LifoQueue()
+        for _ in range(leitores):
+            self._leitores.put(self._abrir())
+        self._escrita = self._abrir(isolation_level=None)
+        self._fila = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="sqlite-escritor", daemon=True)
+        self._thread.start()
+
+    def _abrir(self, **kw):
+        c = sqlite3.connect(self.caminho, check_same_thread=False, timeout=30, **kw)
+        # WAL: leitura não bloqueia a gravação e um crash perde no máximo o último lote
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.execute("PRAGMA foreign_keys=ON")
+        return c
+
+    @contextmanager
+    def _emprestar(self):
+        c = self._leitores.get()
+        try:
+            yield c
+        finally:
+            self._leitores.put(c)
+
+    @contextmanager
+    def leitura(self):
+        """Uma conexão do pool para várias consultas seguidas (medidas com o diagnóstico ligado)."""
+        with self._emprestar() as c:
+            yield CursorMedido(c) if diagnostico.ativo else c
+
+    def ler(self, sql, params=()):
+        with self._emprestar() as c:
+            if not diagnostico.ativo:
+                return c.execute(sql, params).fetchall()
+            t0 = time.perf_counter()
+            try:
+                return c.execute(sql, params).fetchall()
+            finally:
+                diagnostico.sql(sql, (time.perf_counter() - t0) * 1000)
+
+    def ler_um(self, sql, params=()):
+        with self._emprestar() as c:
+            if not diagnostico.ativo:
+                return c.execute(sql, params).fetchone()
+            t0 = time.perf_counter()
+            try:
+                return c.execute(sql, params).fetchone()
+            finally:
+                diagnostico.sql(sql, (time.perf_counter() - t0) * 1000)
+
+    def escrever(self, tarefa, esperar=True, transacao=True):
+        """Enfileira tarefa(cursor); ela roda na thread de escrita, dentro de uma transação.
+
+        A tarefa não deve chamar commit. Com esperar=True devolve o retorno da
+        tarefa (ou repassa a exceção) depois do COMMIT; senão devolve um Future.
+        Com transacao=False a tarefa roda sozinha, fora de transação (VACUUM e
+        checkpoint não podem rodar dentro de uma).
+        """
+        futuro = Future()
+        self._fila.put((tarefa, futuro, transacao))
+        return futuro.result() if esperar else futuro
+
+    def executar(self, sql, params=()):
+        return self.escrever(lambda c: c.execute(sql, params).lastrowid)
+
+    def fechar(self):
+        self._fila.put(None)
+        self._thread.join(timeout=10)
+
+    def _loop(self):
+        proximo = None
+        while True:
+            item = proximo or self._fila.get()
+            proximo = None
+            if item is None:
+                return
+            if not item[2]:
+                self._executar_avulsa(item)
+                continue
+            lote = [item]
+            parar = False
+            while len(lote) < self.LOTE_MAX:
+                try:
+                    proximo = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if proximo is None:
+                    parar = True
+                    break
+                if not proximo[2]:
+                    break  # tarefa avulsa roda logo depois deste lote
+                lote.append(proximo)
+                proximo = None
+            self._executar_lote(lote)
+            if parar:
+                return
+
+    def _executar_avulsa(self, item):
+        tarefa, futuro, _ = item
+        c = self._escrita.cursor()
+        if diagnostico.ativo:
+            c = CursorMedido(c)
+        try:
+            futuro.set_result(tarefa(c))
+        except Exception as ex:
+            futuro.set_exception(ex)
+
+    def _executar_lote(self, lote):
+        c = self._escrita.cursor()
+        if diagnostico.ativo:
+            c = CursorMedido(c)
+        resultados = []
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            for tarefa, futuro, _ in lote:
+                # Savepoint por tarefa: uma falha não derruba as outras do lote
+                c.execute("SAVEPOINT tarefa")
+                try:
+                    resultados.append((futuro, tarefa(c), None))
+                    c.execute("RELEASE tarefa")
+                except Exception as ex:
+                    c.execute("ROLLBACK TO tarefa")
+                    c.execute("RELEASE tarefa")
+                    resultados.append((futuro, None, ex))
+            c.execute("COMMIT")
+        except Exception as ex:
+            if self._escrita.in_transaction:
+                self._escrita.rollback()
+            for _, futuro, _ in lote:
+                futuro.set_exception(ex)
+            return
+        for futuro, valor, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(valor)
+
+# --- RASCUNHO COM GRAVAÇÃO ADIADA (WRITE-BEHIND) ---
+class RascunhoStore:
+    """Rascunhos em memória com gravação em lote numa thread de fundo.
+
+    Cada alteração só marca a chave como suja. Depois de `atraso` segundos sem
+    digitação (ou no máximo `atraso_max` segundos após a primeira alteração
+    pendente) todas as chaves sujas vão para o banco em uma única transação.
+    Cada sessão tem o seu namespace (`sessao`); no tablet ele é sempre ''.
+    """
+
+    def __init__(self, banco, sessao="", atraso=1.0, atraso_max=5.0):
+        self._banco = banco
+        self.sessao = sessao
+        self.atraso = atraso
+        self.atraso_max = atraso_max
+        self._valores = {}
+        self._sujos = set()
+        self._carregado = False
+        self._lock = threading.Lock()      # protege _valores/_sujos
+        self._io_lock = threading.Lock()   # mantém a ordem dos flushes desta sessão
+        self._acordar = threading.Event()
+        self._parar = False
+        self._primeira = 0.0
+        self._ultima = 0.0
+        self._thread = threading.Thread(target=self._loop, name="rascunho-flush", daemon=True)
+        self._thread.start()
+
+    def carregar(self):
+        """Lê a tabela rascunho inteira em uma query (idempotente até limpar())."""
+        with self._lock:
+            if self._carregado:
+                return
+        try:
+            linhas = self._banco.ler("SELECT id, valor FROM rascunho WHERE sessao = ?", (self.sessao,))
+        except sqlite3.Error as ex:
+            # Tenta de novo na próxima chamada (_carregado continua falso)
+            diagnostico.erro("rascunho.carregar", ex)
+            return
+        with self._lock:
+            for chave, valor in linhas:
+                # Não sobrescreve o que ainda está pendente de gravação
+                if chave not in self._sujos:
+                    self._valores[chave] = valor
+            self._carregado = True
+
+    def copia(self):
+        with self._lock:
+            return dict(self._valores)
+
+    def get(self, chave):
+        with self._lock:
+            if chave in self._valores or self._carregado:
+                return self._valores.get(chave, "")
+        try:
+            res = self._banco.ler_um("SELECT valor FROM rascunho WHERE sessao = ? AND id = ?", (self.sessao, chave))
+        except sqlite3.Error as ex:
+            diagnostico.erro("rascunho.get", ex)
+            return ""
+        valor = res[0] if res else ""
+        with self._lock:
+            self._valores.setdefault(chave, valor)
+            return self._valores[chave]
+
+    def set(self, chave, valor):
+        agora = time.monotonic()
+        with self._lock:
+            if self._valores.get(chave) == valor and chave not in self._sujos:
+                return
+            self._valores[chave] = valor
+            if not self._sujos:
+                self._primeira = agora
+            self._sujos.add(chave)
+            self._ultima = agora
+        self._acordar.set()
+
+    def flush(self):
+        """Grava já as chaves pendentes (navegação, PDF, encerramento)."""
+        with self._io_lock:
+            with self._lock:
+                lote = [(self.sessao, k, self._valores[k]) for k in self._sujos]
+                self._sujos.clear()
+            if not lote:
+                return
+            try:
+                self._banco.escrever(lambda c: c.executemany(
+                    "INSERT OR REPLACE INTO rascunho (sessao, id, valor) VALUES (?, ?, ?)", lote))
+            except sqlite3.Error as ex:
+                diagnostico.erro("rascunho.flush", ex)
+                # Mantém as chaves sujas para a próxima tentativa
+                with self._lock:
+                    if not self._sujos:
+                        self._primeira = time.monotonic()
+                    self._sujos.update(k for _, k, _ in lote)
+
+    def limpar(self):
+        with self._io_lock:
+            with self._lock:
+                self._valores.clear()
+                self._sujos.clear()
+                self._carregado = False
+            self._banco.executar("DELETE FROM rascunho WHERE sessao = ?", (self.sessao,))
+
+    def fechar(self):
+        self._parar = True
+        self._acordar.set()
+        self.flush()
+
+    def _loop(self):
+        while not self._parar:
+            self._acordar.wait()
+            # Debounce: espera a digitação parar, sem passar do atraso máximo
+            while not self._parar:
+                with self._lock:
+                    if not self._sujos:
+                        break
+                    prazo = min(self._ultima + self.atraso, self._primeira + self.atraso_max)
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                time.sleep(min(restante, self.atraso))
+            self._acordar.clear()
+            self.flush()
+
+# --- ESQUEMA DO BANCO (MIGRAÇÕES POR VERSÃO) ---
+# Cada função leva o banco da versão N-1 para N. O número fica em PRAGMA user_version,
+# então numa inicialização normal só uma leitura do pragma é feita. Nunca altere uma
+# migração já publicada: acrescente outra no fim da lista.
+def _migracao_base(c):
+    c.execute("CREATE TABLE IF NOT EXISTS opcoes (id INTEGER PRIMARY KEY, tipo TEXT, nome TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS rotina_itens (id INTEGER PRIMARY KEY, titulo TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS historico (id INTEGER PRIMARY KEY, data TEXT, info TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS rascunho (id TEXT PRIMARY KEY, valor TEXT)")
+
+def _migracao_ordem(c):
+    # Bancos antigos podem já ter a coluna (migração feita pela versão sem user_version)
+    colunas = [r[1] for r in c.execute("PRAGMA table_info(rotina_itens)").fetchall()]
+    if "ordem" not in colunas:
+        c.execute("ALTER TABLE rotina_itens ADD COLUMN ordem INTEGER DEFAULT 0")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rotina_ordem ON rotina_itens (ordem, id)")
+    rebalancear_ordem(c)
+
+def _migracao_fotos(c):
+    c.execute("CREATE TABLE IF NOT EXISTS fotos (hash TEXT PRIMARY KEY, largura INTEGER, altura INTEGER, bytes INTEGER, criado_em TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS rascunho_fotos (secao TEXT, hash TEXT, PRIMARY KEY (secao, hash))")
+
+def _migracao_metricas_inicio(c):
+    c.execute("CREATE TABLE IF NOT EXISTS metricas_inicio (id INTEGER PRIMARY KEY, versao TEXT, data TEXT, ms_login REAL)")
+
+def _migracao_indice_opcoes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_opcoes_tipo_nome ON opcoes (tipo, nome)")
+
+def _migracao_sessoes(c):
+    # Rascunhos separados por sessão (modo servidor); '' é a sessão única do tablet
+    c.execute("CREATE TABLE rascunho_novo (sessao TEXT NOT NULL DEFAULT '', id TEXT NOT NULL, valor TEXT, PRIMARY KEY (sessao, id))")
+    c.execute("INSERT INTO rascunho_novo (sessao, id, valor) SELECT '', id, valor FROM rascunho")
+    c.execute("DROP TABLE rascunho")
+    c.execute("ALTER TABLE rascunho_novo RENAME TO rascunho")
+    c.execute("CREATE TABLE rascunho_fotos_novo (sessao TEXT NOT NULL DEFAULT '', secao TEXT, hash TEXT, PRIMARY KEY (sessao, secao, hash))")
+    c.execute("INSERT INTO rascunho_fotos_novo (sessao, secao, hash) SELECT '', secao, hash FROM rascunho_fotos ORDER BY rowid")
+    c.execute("DROP TABLE rascunho_fotos")
+    c.execute("ALTER TABLE rascunho_fotos_novo RENAME TO rascunho_fotos")
+
+def _migracao_execucoes(c):
+    # Rota finalizada vira dado consultável: cabeçalho + resultado por item (pelo id do item)
+    c.execute("""CREATE TABLE execucoes (
+        id INTEGER PRIMARY KEY, data TEXT NOT NULL, lider TEXT, maquina TEXT, turma TEXT, rota TEXT,
+        arquivo TEXT, criado_em TEXT NOT NULL)""")
+    c.execute("CREATE INDEX idx_execucoes_data ON execucoes (data, id)")
+    c.execute("CREATE INDEX idx_execucoes_maquina ON execucoes (maquina, data)")
+    c.execute("CREATE INDEX idx_execucoes_turma ON execucoes (turma, data)")
+    # titulo/ordem são copiados: a rota antiga continua igual mesmo se o checklist mudar
+    c.execute("""CREATE TABLE execucao_itens (
+        execucao_id INTEGER NOT NULL REFERENCES execucoes (id) ON DELETE CASCADE,
+        item_id INTEGER NOT NULL, ordem INTEGER NOT NULL, titulo TEXT NOT NULL, observacao TEXT,
+        PRIMARY KEY (execucao_id, item_id))""")
+    c.execute("CREATE INDEX idx_execucao_itens_item ON execucao_itens (item_id)")
+    c.execute("""CREATE TABLE execucao_fotos (
+        execucao_id INTEGER NOT NULL REFERENCES execucoes (id) ON DELETE CASCADE,
+        item_id INTEGER NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (execucao_id, item_id, hash))""")
+    c.execute("ALTER TABLE historico ADD COLUMN execucao_id INTEGER")
+    # Rascunhos e fotos passam a ser ligados ao id do item (renomear não perde mais a observação)
+    c.execute("""UPDATE OR REPLACE rascunho SET id = 'obs_' || (
+            SELECT MIN(ri.id) FROM rotina_itens ri WHERE 'obs_' || ri.titulo = rascunho.id)
+        WHERE id LIKE 'obs_%' AND EXISTS (SELECT 1 FROM rotina_itens ri WHERE 'obs_' || ri.titulo = rascunho.id)""")
+    c.execute("""UPDATE OR REPLACE rascunho_fotos SET secao = (
+            SELECT CAST(MIN(ri.id) AS TEXT) FROM rotina_itens ri WHERE ri.titulo = rascunho_fotos.secao)
+        WHERE EXISTS (SELECT 1 FROM rotina_itens ri WHERE ri.titulo = rascunho_fotos.secao)""")
+
+def _migracao_historico(c):
+    # Data ordenável (ISO) e turma no próprio histórico: paginação por índice, sem ler arquivos
+    c.execute("""UPDATE historico SET data = substr(data, 7, 4) || '-' || substr(data, 4, 2) || '-' || substr(data, 1, 2)
+        WHERE data LIKE '__/__/____'""")
+    c.execute("ALTER TABLE historico ADD COLUMN turma TEXT")
+    c.execute("UPDATE historico SET turma = (SELECT e.turma FROM execucoes e WHERE e.id = historico.execucao_id) WHERE execucao_id IS NOT NULL")
+    # Registros antigos: o nome do arquivo é '<dd_mm_YYYY>_<turma>.pdf'
+    c.execute("""UPDATE historico SET turma = substr(info, 12, length(info) - 15)
+        WHERE turma IS NULL AND info LIKE '__!___!_____!_%.pdf' ESCAPE '!'""")
+    c.execute("CREATE INDEX idx_historico_data ON historico (data, id)")
+    c.execute("CREATE INDEX idx_historico_turma ON historico (turma, data, id)")
+
+def _criar_busca(c, chave):
+    # Índice de texto (FTS5) sobre título e observação dos itens das rotas finalizadas.
+    # Tabela de conteúdo externo: o texto fica só em execucao_itens, os triggers mantêm o índice.
+    try:
+        c.execute(f"""CREATE VIRTUAL TABLE busca_itens USING fts5(
+            titulo, observacao, content='execucao_itens', content_rowid='{chave}',
+            tokenize='unicode61 remove_diacritics 2')""")
+    except sqlite3.OperationalError:
+        return  # SQLite sem FTS5: buscar_observacoes() cai no LIKE
+    c.execute(f"""CREATE TRIGGER busca_itens_ai AFTER INSERT ON execucao_itens BEGIN
+        INSERT INTO busca_itens (rowid, titulo, observacao) VALUES (new.{chave}, new.titulo, new.observacao);
+    END""")
+    c.execute(f"""CREATE TRIGGER busca_itens_ad AFTER DELETE ON execucao_itens BEGIN
+        INSERT INTO busca_itens (busca_itens, rowid, titulo, observacao) VALUES ('delete', old.{chave}, old.titulo, old.observacao);
+    END""")
+    c.execute(f"""CREATE TRIGGER busca_itens_au AFTER UPDATE ON execucao_itens BEGIN
+        INSERT INTO busca_itens (busca_itens, rowid, titulo, observacao) VALUES ('delete', old.{chave}, old.titulo, old.observacao);
+        INSERT INTO busca_itens (rowid, titulo, observacao) VALUES (new.{chave}, new.titulo, new.observacao);
+    END""")
+    c.execute("INSERT INTO busca_itens (busca_itens) VALUES ('rebuild')")
+
+def _migracao_busca(c):
+    _criar_busca(c, "rowid")
+
+def _migracao_configuracao(c):
+    # Ajustes feitos no admin (retenção, limite de disco...); o padrão fica no código
+    c.execute("CREATE TABLE configuracao (chave TEXT PRIMARY KEY, valor TEXT)")
+
+# Hora UTC com milissegundos: compara como texto e serve para "o último vence" entre aparelhos
+AGORA_SQL = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+
+def _migracao_sincronizacao(c):
+    # uid: identidade do registro em todos os aparelhos (o id local é só deste banco)
+    for tabela in ("rotina_itens", "opcoes"):
+        c.execute(f"ALTER TABLE {tabela} ADD COLUMN uid TEXT")
+        c.execute(f"ALTER TABLE {tabela} ADD COLUMN alterado_em TEXT")
+        c.execute(f"UPDATE {tabela} SET alterado_em = {AGORA_SQL}")
+    c.execute("ALTER TABLE execucoes ADD COLUMN uid TEXT")
+    for tabela in ("rotina_itens", "opcoes", "execucoes"):
+        c.execute(f"UPDATE {tabela} SET uid = lower(hex(randomblob(16)))")
+        c.execute(f"CREATE UNIQUE INDEX idx_{tabela}_uid ON {tabela} (uid)")
+
+    # Log de alterações locais a enviar (AUTOINCREMENT: o log é podado e seq nunca pode
+    # voltar para trás do cursor já enviado); apagar fica guardado (lápide) para um dado
+    # antigo vindo de outro aparelho não ressuscitar o registro
+    c.execute(f"""CREATE TABLE alteracoes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, tabela TEXT NOT NULL, uid TEXT NOT NULL, operacao TEXT NOT NULL,
+        alterado_em TEXT NOT NULL DEFAULT ({AGORA_SQL}), remoto INTEGER NOT NULL DEFAULT 0)""")
+    c.execute("CREATE INDEX idx_alteracoes_uid ON alteracoes (tabela, uid)")
+    # Com uma linha aqui (só durante a aplicação do que veio do coletor) os triggers não registram nada
+    c.execute("CREATE TABLE sync_aplicando (ativo INTEGER)")
+
+    campos = {"rotina_itens": "titulo, ordem", "opcoes": "tipo, nome"}
+    for tabela, colunas in campos.items():
+        mudou = " OR ".join(f"old.{col} IS NOT new.{col}" for col in colunas.split(", "))
+        c.execute(f"""CREATE TRIGGER sync_{tabela}_ai AFTER INSERT ON {tabela}
+            WHEN NOT EXISTS (SELECT 1 FROM sync_aplicando) BEGIN
+            UPDATE {tabela} SET uid = coalesce(new.uid, lower(hex(randomblob(16)))), alterado_em = {AGORA_SQL} WHERE id = new.id;
+            INSERT INTO alteracoes (tabela, uid, operacao) SELECT '{tabela}', uid, 'gravar' FROM {tabela} WHERE id = new.id;
+        END""")
+        c.execute(f"""CREATE TRIGGER sync_{tabela}_au AFTER UPDATE OF {colunas} ON {tabela}
+            WHEN ({mudou}) AND NOT EXISTS (SELECT 1 FROM sync_aplicando) BEGIN
+            UPDATE {tabela} SET alterado_em = {AGORA_SQL} WHERE id = new.id;
+            INSERT INTO alteracoes (tabela, uid, operacao) VALUES ('{tabela}', new.uid, 'gravar');
+        END""")
+        c.execute(f"""CREATE TRIGGER sync_{tabela}_ad AFTER DELETE ON {tabela}
+            WHEN NOT EXISTS (SELECT 1 FROM sync_aplicando) BEGIN
+            INSERT INTO alteracoes (tabela, uid, operacao) VALUES ('{tabela}', old.uid, 'apagar');
+        END""")
+    # Rota finalizada não muda mais: só a criação vai para o log
+    c.execute("""CREATE TRIGGER sync_execucoes_ai AFTER INSERT ON execucoes
+        WHEN NOT EXISTS (SELECT 1 FROM sync_aplicando) BEGIN
+        UPDATE execucoes SET uid = coalesce(new.uid, lower(hex(randomblob(16)))) WHERE id = new.id;
+        INSERT INTO alteracoes (tabela, uid, operacao) SELECT 'execucoes', uid, 'gravar' FROM execucoes WHERE id = new.id;
+    END""")
+
+    # O que já existe vai no primeiro envio
+    c.execute("INSERT INTO alteracoes (tabela, uid, operacao) SELECT 'opcoes', uid, 'gravar' FROM opcoes ORDER BY tipo, nome")
+    c.execute("INSERT INTO alteracoes (tabela, uid, operacao) SELECT 'rotina_itens', uid, 'gravar' FROM rotina_itens ORDER BY ordem, id")
+    c.execute("INSERT INTO alteracoes (tabela, uid, operacao) SELECT 'execucoes', uid, 'gravar' FROM execucoes ORDER BY id")
+
+def _migracao_resumos(c):
+    # Resumos somados a cada rota finalizada: o painel do início lê só estas tabelas
+    c.execute("""CREATE TABLE resumo_dia (
+        data TEXT NOT NULL, maquina TEXT NOT NULL, turma TEXT NOT NULL, lider TEXT NOT NULL, rota TEXT NOT NULL,
+        rotas INTEGER NOT NULL, itens INTEGER NOT NULL, itens_com_obs INTEGER NOT NULL, fotos INTEGER NOT NULL,
+        PRIMARY KEY (data, maquina, turma, lider, rota))""")
+    c.execute("""CREATE TABLE resumo_item (
+        mes TEXT NOT NULL, item_id INTEGER NOT NULL, titulo TEXT NOT NULL,
+        verificacoes INTEGER NOT NULL, ocorrencias INTEGER NOT NULL, PRIMARY KEY (mes, item_id))""")
+    # Rotas já salvas entram de uma vez
+    c.execute("""INSERT INTO resumo_dia
+        SELECT e.data, coalesce(e.maquina, ''), coalesce(e.turma, ''), coalesce(e.lider, ''), coalesce(e.rota, ''),
+               COUNT(DISTINCT e.id), COUNT(i.item_id), COUNT(nullif(i.observacao, '')),
+               coalesce(SUM((SELECT COUNT(*) FROM execucao_fotos f WHERE f.execucao_id = e.id AND f.item_id = i.item_id)), 0)
+        FROM execucoes e LEFT JOIN execucao_itens i ON i.execucao_id = e.id
+        GROUP BY 1, 2, 3, 4, 5""")
+    c.execute("""INSERT INTO resumo_item
+        SELECT substr(e.data, 1, 7), i.item_id, MAX(i.titulo), COUNT(*), COUNT(nullif(i.observacao, ''))
+        FROM execucoes e JOIN execucao_itens i ON i.execucao_id = e.id
+        GROUP BY 1, 2""")
+
+def _migracao_itens_id(c):
+    # id explícito em execucao_itens: o rowid implícito pode ser renumerado pelo VACUUM
+    # e o índice de busca (conteúdo externo) passaria a apontar para os itens errados
+    c.execute("DROP TABLE IF EXISTS busca_itens")
+    c.execute("""CREATE TABLE execucao_itens_novo (
+        id INTEGER PRIMARY KEY,
+        execucao_id INTEGER NOT NULL REFERENCES execucoes (id) ON DELETE CASCADE,
+        item_id INTEGER NOT NULL, ordem INTEGER NOT NULL, titulo TEXT NOT NULL, observacao TEXT,
+        UNIQUE (execucao_id, item_id))""")
+    c.execute("""INSERT INTO execucao_itens_novo (id, execucao_id, item_id, ordem, titulo, observacao)
+        SELECT rowid, execucao_id, item_id, ordem, titulo, observacao FROM execucao_itens""")
+    c.execute("DROP TABLE execucao_itens")
+    c.execute("ALTER TABLE execucao_itens_novo RENAME TO execucao_itens")
+    c.execute("CREATE INDEX idx_execucao_itens_item ON execucao_itens (item_id)")
+    _criar_busca(c, "id")
+
+MIGRACOES = [
+    _migracao_base,
+    _migracao_ordem,
+    _migracao_fotos,
+    _migracao_metricas_inicio,
+    _migracao_indice_opcoes,
+    _migracao_sessoes,
+    _migracao_execucoes,
+    _migracao_historico,
+    _migracao_busca,
+    _migracao_configuracao,
+    _migracao_sincronizacao,
+    _migracao_resumos,
+    _migracao_itens_id,
+]
+
+def migrar(conexao):
+    """Aplica só as migrações pendentes, cada uma na sua transação."""
+    # Em autocommit o BEGIN é explícito: o sqlite3 não confirma DDL por conta própria
+    # e uma migração que falha no meio volta inteira, sem avançar o user_version
+    isolamento = conexao.isolation_level
+    conexao.isolation_level = None
+    try:
+        versao = conexao.execute("PRAGMA user_version").fetchone()[0]
+        for numero, migracao in enumerate(MIGRACOES[versao:], start=versao + 1):
+            c = conexao.cursor()
+            c.execute("BEGIN")
+            try:
+                migracao(c)
+                c.execute(f"PRAGMA user_version = {numero}")
+                c.execute("COMMIT")
+            except BaseException:
+                c.execute("ROLLBACK")
+                raise
+    finally:
+        conexao.isolation_level = isolamento
+    return versao
+
+def registrar_inicio(banco, ms):
+    diagnostico.registrar("inicio", "login", ms)
+
+    def gravar(c):
+        c.execute("INSERT INTO metricas_inicio (versao, data, ms_login) VALUES (?, ?, ?)",
+                  (APP_VERSAO, datetime.datetime.now().isoformat(timespec="seconds"), ms))
+        # Só as últimas medições interessam: a tabela não cresce a cada abertura
+        c.execute("DELETE FROM metricas_inicio WHERE id <= (SELECT MAX(id) FROM metricas_inicio) - ?",
+                  (METRICAS_INICIO_MAX,))
+    # Sem esperar o commit: a métrica não pode atrasar a tela de login
+    banco.escrever(gravar, esperar=False)
+
+# --- CATÁLOGO DE OPÇÕES (LÍDER / MÁQUINA / TURMA / ROTA) ---
+class CatalogoOpcoes:
+    """Todas as categorias da tabela opcoes em memória, lidas com uma única query.
+
+    Só o cadastro/remoção na tela de administração invalida o catálogo; `versao`
+    muda a cada recarga para a tela da rota saber se precisa refazer os dropdowns.
+    """
+
+    def __init__(self, banco):
+        self._banco = banco
+        self._lock = threading.Lock()
+        self._itens = None
+        self.versao = 0
+
+    def carregar(self):
+        with self._lock:
+            if self._itens is None:
+                itens = {}
+                # Percorre o índice (tipo, nome) na ordem: agrupado e já ordenado
+                for tipo, item_id, nome in self._banco.ler("SELECT tipo, id, nome FROM opcoes ORDER BY tipo, nome"):
+                    itens.setdefault(tipo, []).append((item_id, nome))
+                self._itens = itens
+                self.versao += 1
+            return self._itens
+
+    def itens(self, tipo):
+        return list(self.carregar().get(tipo, []))
+
+    def nomes(self, tipo):
+        return [nome for _, nome in self.carregar().get(tipo, [])]
+
+    def invalidar(self):
+        with self._lock:
+            self._itens = None
+
+# --- FOTOS (ARMAZENAMENTO POR HASH) ---
+FOTO_LADO_MAX = 1024    # versão reduzida usada no PDF
+FOTO_MINIATURA = 160    # miniatura mostrada na tela da rota
+FOTO_QUALIDADE = 80
+
+class FotoStore:
+    """Guarda cada foto uma única vez (nome = sha256 do arquivo original).
+
+    A câmera entrega imagens de 8-12 MB; aqui só ficam a versão reduzida e a
+    miniatura, geradas num pool em segundo plano. O vínculo com o item do
+    checklist fica na tabela rascunho_fotos até a rota ser finalizada.
+    """
+
+    def __init__(self, banco, workers=2):
+        self.pasta = os.path.join(os.path.dirname(banco.caminho), "fotos")
+        os.makedirs(self.pasta, exist_ok=True)
+        self._banco = banco
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fotos")
+
+    def caminho(self, digest):
+        return os.path.join(self.pasta, f"{digest}.jpg")
+
+    def caminho_miniatura(self, digest):
+        return os.path.join(self.pasta, f"{digest}_mini.jpg")
+
+    def adicionar(self, sessao, secao, origem, ao_terminar=None):
+        """Processa a foto em segundo plano; ao_terminar(digest, erro) é chamado no fim."""
+        def tarefa():
+            try:
+                digest, largura, altura, tamanho = self._processar(origem)
+
+                def gravar(c):
+                    c.execute(
+                        "INSERT OR IGNORE INTO fotos (hash, largura, altura, bytes, criado_em) VALUES (?, ?, ?, ?, ?)",
+                        (digest, largura, altura, tamanho, datetime.datetime.now().isoformat(timespec="seconds")))
+                    c.execute("INSERT OR IGNORE INTO rascunho_fotos (sessao, secao, hash) VALUES (?, ?, ?)", (sessao, secao, digest))
+                self._banco.escrever(gravar)
+            except Exception as ex:
+                if ao_terminar: ao_terminar(None, ex)
+                return
+            if ao_terminar: ao_terminar(digest, None)
+        return self._pool.submit(tarefa)
+
+    def _processar(self, origem):
+        h = hashlib.sha256()
+        with open(origem, "rb") as f:
+            for bloco in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloco)
+        digest = h.hexdigest()
+        destino, mini = self.caminho(digest), self.caminho_miniatura(digest)
+        if os.path.exists(destino) and os.path.exists(mini):
+            # Mesma foto já processada antes: nada a fazer
+            from PIL import Image
+            with Image.open(destino) as img:
+                return digest, img.width, img.height, os.path.getsize(destino)
+
+        from PIL import Image, ImageOps
+        with Image.open(origem) as img:
+            # draft() faz o decoder JPEG já ler em escala reduzida (bem mais rápido e leve)
+            img.draft("RGB", (FOTO_LADO_MAX, FOTO_LADO_MAX))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail((FOTO_LADO_MAX, FOTO_LADO_MAX))
+            self._salvar(img, destino)
+            largura, altura = img.size
+            img.thumbnail((FOTO_MINIATURA, FOTO_MINIATURA))
+            self._salvar(img, mini)
+        return digest, largura, altura, os.path.getsize(destino)
+
+    def _salvar(self, img, destino):
+        gravar_arquivo(destino, lambda temporario: img.save(temporario, "JPEG", quality=FOTO_QUALIDADE, optimize=True))
+
+    def por_secao(self, sessao=""):
+        """{secao: [hash, ...]} das fotos do rascunho atual, na ordem em que foram tiradas."""
+        linhas = self._banco.ler("SELECT secao, hash FROM rascunho_fotos WHERE sessao = ? ORDER BY rowid", (sessao,))
+        resultado = {}
+        for secao, digest in linhas:
+            resultado.setdefault(secao, []).append(digest)
+        return resultado
+
+    def limpar_rascunho(self, sessao=""):
+        self._banco.executar("DELETE FROM rascunho_fotos WHERE sessao = ?", (sessao,))
+
+    def fechar(self):
+        self._pool.shutdown(wait=True)
+
+# --- RELATÓRIO PDF ---
+class RelatorioCancelado(Exception):
+    pass
+
+def novo_pdf():
+    from fpdf import FPDF
+    return FPDF()
+
+def escrever_rota(pdf, cab, itens, progresso=None, cancelado=None):
+    """Acrescenta uma rota (começando numa página nova) a um documento FPDF."""
+    pdf.add_page()
+
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(0, 10, txt="RELATORIO DE ROTA FITESA", ln=True, align='C')
+    pdf.set_font("Arial", size=12)
+    pdf.ln(5)
+
+    pdf.cell(0, 10, txt=f"Data: {cab['data']}", ln=True)
+    pdf.cell(0, 10, txt=f"Lider: {cab['lider']} | Turma: {cab['turma']}", ln=True)
+    pdf.cell(0, 10, txt=f"Maquina: {cab['maquina']} | Rota: {cab['rota']}", ln=True)
+    pdf.ln(5)
+    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+    pdf.ln(5)
+
+    if not itens:
+        pdf.cell(0, 10, txt="Nenhum item cadastrado.", ln=True)
+        return
+    passo = max(1, len(itens) // 50)
+    for n, item in enumerate(itens):
+        if cancelado is not None and cancelado.is_set():
+            raise RelatorioCancelado()
+        obs = item["obs"]
+        pdf.set_font("Arial", 'B', 12)
+        pdf.cell(0, 8, txt=f"- {item['titulo']}", ln=True)
+        if obs:
+            pdf.set_font("Arial", size=11)
+            pdf.multi_cell(0, 6, txt=f"  Obs: {obs}")
+        else:
+            pdf.set_font("Arial", 'I', 10)
+            pdf.cell(0, 6, txt="  (Sem observacoes)", ln=True)
+        # Fotos já reduzidas pelo FotoStore: tamanho do PDF fica limitado
+        for foto in item["fotos"]:
+            if os.path.exists(foto):
+                pdf.image(foto, x=15, w=80)
+                pdf.ln(2)
+        pdf.ln(2)
+        if progresso and n % passo == 0:
+            progresso(0.9 * n / len(itens))
+
+def gravar_arquivo(caminho, escrever):
+    """Grava num temporário e renomeia: nunca fica arquivo pela metade."""
+    # Nome único na mesma pasta: duas sessões gravando o mesmo destino não se atropelam
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho) or ".",
+                                      prefix=os.path.basename(caminho) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        escrever(temporario)
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+def montar_relatorio(caminho, cab, itens, progresso=None, cancelado=None):
+    """Gera o PDF de uma rota a partir de uma cópia do formulário.
+
+    Roda fora da thread da interface: recebe só dados e nunca toca nos controles
+    do Flet. `itens` é uma lista de dicts com titulo, obs e fotos (caminhos das
+    imagens já reduzidas), no formato de itens_execucao()/carregar_execucao().
+    """
+    pdf = novo_pdf()
+    escrever_rota(pdf, cab, itens, progresso, cancelado)
+    if cancelado is not None and cancelado.is_set():
+        raise RelatorioCancelado()
+    gravar_arquivo(caminho, pdf.output)
+    if progresso:
+        progresso(1.0)
+    return caminho
+
+# --- EXECUÇÕES DE ROTA (ROTAS FINALIZADAS) ---
+def data_iso(texto):
+    """'dd/mm/YYYY' da tela -> 'YYYY-MM-DD' (ordenável) para o banco."""
+    try:
+        return datetime.datetime.strptime(texto, "%d/%m/%Y").date().isoformat()
+    except (TypeError, ValueError):
+        return texto
+
+def data_br(iso):
+    try:
+        return datetime.date.fromisoformat(iso).strftime("%d/%m/%Y")
+    except (TypeError, ValueError):
+        return iso
+
+def itens_execucao(itens_rota, rascunho, fotos_secao, fotos):
+    """Monta os itens de uma rota a partir do rascunho: [(id, titulo)] -> [dict]."""
+    return [{"item_id": item_id, "titulo": titulo, "obs": rascunho.get(f"obs_{item_id}", ""),
+             "hashes": fotos_secao.get(str(item_id), []),
+             "fotos": [fotos.caminho(h) for h in fotos_secao.get(str(item_id), [])]}
+            for item_id, titulo in itens_rota]
+
+def salvar_execucao(banco, cab, itens, arquivo):
+    """Grava cabeçalho, itens, fotos e a linha do histórico numa única transação."""
+    def tarefa(c):
+        c.execute("INSERT INTO execucoes (data, lider, maquina, turma, rota, arquivo, criado_em) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (data_iso(cab["data"]), cab["lider"], cab["maquina"], cab["turma"], cab["rota"], arquivo,
+                   datetime.datetime.now().isoformat(timespec="seconds")))
+        execucao_id = c.lastrowid
+        c.executemany("INSERT INTO execucao_itens (execucao_id, item_id, ordem, titulo, observacao) VALUES (?, ?, ?, ?, ?)",
+                      [(execucao_id, it["item_id"], n, it["titulo"], it["obs"] or None) for n, it in enumerate(itens)])
+        c.executemany("INSERT OR IGNORE INTO execucao_fotos (execucao_id, item_id, hash) VALUES (?, ?, ?)",
+                      [(execucao_id, it["item_id"], h) for it in itens for h in it.get("hashes", [])])
+        c.execute("INSERT INTO historico (data, info, execucao_id, turma) VALUES (?, ?, ?, ?)",
+                  (data_iso(cab["data"]), arquivo, execucao_id, cab["turma"]))
+        acumular_resumos(c, cab, itens)
+        return execucao_id
+    return banco.escrever(tarefa)
+
+def carregar_execucao(banco, execucao_id, fotos=None):
+    """(cab, itens) de uma execução salva, no mesmo formato usado por montar_relatorio."""
+    linha = banco.ler_um("SELECT data, lider, maquina, turma, rota FROM execucoes WHERE id = ?", (execucao_id,))
+    if not linha:
+        return None
+    cab = {"data": data_br(linha[0]), "lider": linha[1], "maquina": linha[2], "turma": linha[3], "rota": linha[4]}
+    hashes = {}
+    for item_id, h in banco.ler("SELECT item_id, hash FROM execucao_fotos WHERE execucao_id = ? ORDER BY rowid", (execucao_id,)):
+        hashes.setdefault(item_id, []).append(h)
+    itens = [{"item_id": item_id, "titulo": titulo, "obs": obs or "", "hashes": hashes.get(item_id, []),
+              "fotos": [fotos.caminho(h) for h in hashes.get(item_id, [])] if fotos else []}
+             for item_id, titulo, obs in banco.ler(
+                 "SELECT item_id, titulo, observacao FROM execucao_itens WHERE execucao_id = ? ORDER BY ordem", (execucao_id,))]
+    return cab, itens
+
+def pagina_historico(banco, apos=None, inicio=None, fim=None, turma=None, limite=30, maquina=None):
+    """Uma página do histórico, do mais recente para o mais antigo (paginação por chave).
+
+    `apos` é o (data, id) da última linha da página anterior; cada página é uma
+    busca no índice, então o custo não cresce com o tamanho do histórico.
+    Filtrar por máquina deixa de fora os relatórios antigos, sem execução salva.
+    Devolve (linhas, chave da próxima página ou None).
+    """
+    sql = "SELECT id, data, turma, info, execucao_id FROM historico WHERE 1=1"
+    params = []
+    if turma:
+        sql += " AND turma = ?"; params.append(turma)
+    if maquina:
+        # A máquina só existe em execucoes (índice por maquina, data)
+        sql += " AND execucao_id IN (SELECT id FROM execucoes WHERE maquina = ?)"; params.append(maquina)
+    if inicio:
+        sql += " AND data >= ?"; params.append(inicio)
+    if fim:
+        sql += " AND data <= ?"; params.append(fim)
+    if apos:
+        sql += " AND (data, id) < (?, ?)"; params.extend(apos)
+    sql += " ORDER BY data DESC, id DESC LIMIT ?"
+    params.append(limite)
+    linhas = banco.ler(sql, params)
+    proxima = (linhas[-1][1], linhas[-1][0]) if len(linhas) == limite else None
+    return linhas, proxima
+
+def buscar_observacoes(banco, texto, limite=50):
+    """Itens de rotas finalizadas que batem com `texto`, dos mais relevantes aos menos.
+
+    Cada palavra vira um prefixo ("rolam" acha "rolamento") e todas precisam
+    aparecer. Devolve (execucao_id, data, maquina, turma, arquivo, titulo, trecho).
+    """
+    palavras = re.findall(r"\w+", texto or "")
+    if not palavras:
+        return []
+    if banco.ler_um("SELECT 1 FROM sqlite_master WHERE name = 'busca_itens'"):
+        consulta = " ".join(f'"{p}"*' for p in palavras)
+        return banco.ler(
+            """SELECT e.id, e.data, e.maquina, e.turma, e.arquivo, ei.titulo,
+                      snippet(busca_itens, 1, '[', ']', '...', 12)
+               FROM busca_itens
+               JOIN execucao_itens ei ON ei.id = busca_itens.rowid
+               JOIN execucoes e ON e.id = ei.execucao_id
+               WHERE busca_itens MATCH ? ORDER BY rank LIMIT ?""", (consulta, limite))
+    # Sem FTS5 no SQLite do aparelho: varredura simples, mais recentes primeiro
+    sql = ("SELECT e.id, e.data, e.maquina, e.turma, e.arquivo, ei.titulo, ei.observacao "
+           "FROM execucao_itens ei JOIN execucoes e ON e.id = ei.execucao_id WHERE 1=1")
+    params = []
+    for p in palavras:
+        sql += " AND (ei.titulo LIKE ? OR ei.observacao LIKE ?)"
+        params += [f"%{p}%", f"%{p}%"]
+    return banco.ler(sql + " ORDER BY e.data DESC, e.id DESC LIMIT ?", params + [limite])
+
+# --- INDICADORES (RESUMOS PRÉ-CALCULADOS) ---
+def acumular_resumos(c, cab, itens):
+    """Soma uma rota finalizada em resumo_dia/resumo_item (na transação do salvar_execucao)."""
+    data = data_iso(cab["data"]) or ""
+    c.execute("""INSERT INTO resumo_dia (data, maquina, turma, lider, rota, rotas, itens, itens_com_obs, fotos)
+        VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT (data, maquina, turma, lider, rota) DO UPDATE SET
+            rotas = rotas + 1, itens = itens + excluded.itens,
+            itens_com_obs = itens_com_obs + excluded.itens_com_obs, fotos = fotos + excluded.fotos""",
+              (data, cab["maquina"] or "", cab["turma"] or "", cab["lider"] or "", cab["rota"] or "",
+               len(itens), sum(1 for it in itens if it["obs"]), sum(len(it.get("hashes", [])) for it in itens)))
+    c.executemany("""INSERT INTO resumo_item (mes, item_id, titulo, verificacoes, ocorrencias) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT (mes, item_id) DO UPDATE SET
+            titulo = excluded.titulo, verificacoes = verificacoes + 1, ocorrencias = ocorrencias + excluded.ocorrencias""",
+                  [(data[:7], it["item_id"], it["titulo"], 1 if it["obs"] else 0) for it in itens])
+
+def inicio_periodo(meses, hoje=None):
+    """Primeiro dia do mês de `meses - 1` meses atrás (1 = mês atual), em ISO."""
+    hoje = hoje or datetime.date.today()
+    ano, mes = hoje.year, hoje.month - (meses - 1)
+    while mes <= 0:
+        mes += 12
+        ano -= 1
+    return datetime.date(ano, mes, 1).isoformat()
+
+def indicadores(banco, inicio, limite=5):
+    """Números do painel desde `inicio` (primeiro dia de um mês), lidos só dos resumos."""
+    rotas, itens, com_obs, fotos = banco.ler_um(
+        "SELECT COALESCE(SUM(rotas), 0), COALESCE(SUM(itens), 0), COALESCE(SUM(itens_com_obs), 0), COALESCE(SUM(fotos), 0) "
+        "FROM resumo_dia WHERE data >= ?", (inicio,))
+
+    def ranking(coluna):
+        return banco.ler(f"SELECT {coluna}, SUM(itens_com_obs), SUM(rotas) FROM resumo_dia WHERE data >= ? "
+                         f"GROUP BY {coluna} ORDER BY 2 DESC, 3 DESC LIMIT ?", (inicio, limite))
+
+    return {
+        "rotas": rotas, "itens": itens, "itens_com_obs": com_obs, "fotos": fotos,
+        "maquinas": ranking("maquina"),
+        "turmas": ranking("turma"),
+        "lideres": ranking("lider"),
+        "itens_apontados": banco.ler(
+            "SELECT MAX(titulo), SUM(ocorrencias), SUM(verificacoes) FROM resumo_item WHERE mes >= ? "
+            "GROUP BY item_id HAVING SUM(ocorrencias) > 0 ORDER BY 2 DESC, 3 DESC LIMIT ?", (inicio[:7], limite)),
+    }
+
+# --- EXPORTAÇÃO EM LOTE ---
+# O PDF único fica inteiro na memória até ser gravado; acima disto só em ZIP
+LOTE_PDF_MAX = 100
+
+def ids_execucoes(banco, inicio=None, fim=None, turma=None, maquina=None):
+    """Execuções de um período (datas ISO), da mais antiga para a mais nova."""
+    sql, params = "SELECT id FROM execucoes WHERE 1=1", []
+    if maquina:
+        sql += " AND maquina = ?"; params.append(maquina)
+    if inicio:
+        sql += " AND data >= ?"; params.append(inicio)
+    if fim:
+        sql += " AND data <= ?"; params.append(fim)
+    if turma:
+        sql += " AND turma = ?"; params.append(turma)
+    return [r[0] for r in banco.ler(sql + " ORDER BY data, id", params)]
+
+def _em_janela(pool, funcao, entradas, janela):
+    """Como pool.map, mas com no máximo `janela` tarefas em andamento (memória limitada)."""
+    pendentes = []
+    for entrada in entradas:
+        pendentes.append(pool.submit(funcao, entrada))
+        if len(pendentes) >= janela:
+            yield pendentes.pop(0).result()
+    for futuro in pendentes:
+        yield futuro.result()
+
+def exportar_lote(banco, fotos, execucao_ids, destino, formato="pdf", progresso=None, cancelado=None, workers=2):
+    """Junta várias rotas salvas num único PDF (uma rota por página nova) ou num ZIP de PDFs.
+
+    As execuções são lidas do banco por um pool, com poucas à frente da que está
+    sendo escrita. No ZIP cada rota é gerada em paralelo e gravada no arquivo
+    assim que fica pronta, na ordem, então a memória não cresce com o período.
+    No PDF único o fpdf2 guarda o documento todo até o output(): a memória cresce
+    com o número de rotas, por isso ele é limitado a LOTE_PDF_MAX rotas.
+    """
+    total = len(execucao_ids)
+    if formato != "zip" and total > LOTE_PDF_MAX:
+        raise ValueError(f"{total} rotas passam do limite de {LOTE_PDF_MAX} do PDF único; exporte em ZIP")
+    janela = workers * 2
+
+    def verificar():
+        if cancelado is not None and cancelado.is_set():
+            raise RelatorioCancelado()
+
+    def carregar(execucao_id):
+        verificar()
+        return execucao_id, carregar_execucao(banco, execucao_id, fotos)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exportar") as pool:
+        if formato == "zip":
+            import zipfile
+
+            def renderizar(execucao_id):
+                _, dados = carregar(execucao_id)
+                if not dados:
+                    return None  # apagada no meio da exportação: fica de fora, como no PDF único
+                pdf = novo_pdf()
+                escrever_rota(pdf, *dados, cancelado=cancelado)
+                cab = dados[0]
+                return f"{cab['data'].replace('/', '_')}_{cab['turma']}_{execucao_id}.pdf", bytes(pdf.output())
+
+            def escrever_zip(temporario):
+                # PDF já é comprimido: ZIP_STORED evita gastar CPU à toa
+                with zipfile.ZipFile(temporario, "w", compression=zipfile.ZIP_STORED) as zf:
+                    for n, arquivo in enumerate(_em_janela(pool, renderizar, execucao_ids, janela), start=1):
+                        verificar()
+                        if arquivo:
+                            zf.writestr(*arquivo)
+                        if progresso:
+                            progresso(n / max(1, total))
+
+            gravar_arquivo(destino, escrever_zip)
+        else:
+            pdf = novo_pdf()
+            for n, (execucao_id, dados) in enumerate(_em_janela(pool, carregar, execucao_ids, janela), start=1):
+                verificar()
+                if dados:
+                    escrever_rota(pdf, *dados, cancelado=cancelado)
+                if progresso:
+                    progresso(0.9 * n / max(1, total))
+            if total == 0:
+                pdf.add_page()
+                pdf.set_font("Arial", size=12)
+                pdf.cell(0, 10, txt="Nenhuma rota no periodo.", ln=True)
+            verificar()
+            gravar_arquivo(destino, pdf.output)
+    if progresso:
+        progresso(1.0)
+    return destino
+
+# --- IMPORTAÇÃO / EXPORTAÇÃO DO CADASTRO ---
+# Mesmas categorias do cadastro no admin; "rotina" são os itens do checklist
+TIPOS_CADASTRO = ("lider", "maquina", "turma", "rota", "rotina")
+CADASTRO_NOME_MAX = 200
+
+class ErroImportacao(Exception):
+    pass
+
+def _linhas_arquivo(caminho):
+    """(número da linha, tipo, nome) de um CSV (tipo;nome ou tipo,nome) ou JSON."""
+    if caminho.lower().endswith(".json"):
+        with open(caminho, encoding="utf-8-sig") as f:
+            dados = json.load(f)
+        # {"lider": [...], "rotina": [...]} ou [{"tipo": ..., "nome": ...}, ...]
+        if isinstance(dados, dict):
+            n = 0
+            for tipo, nomes in dados.items():
+                for nome in (nomes if isinstance(nomes, list) else [nomes]):
+                    n += 1
+                    yield n, tipo, nome
+        elif isinstance(dados, list):
+            for n, item in enumerate(dados, start=1):
+                if isinstance(item, dict):
+                    yield n, item.get("tipo"), item.get("nome")
+                else:
+                    yield n, None, item
+        else:
+            raise ErroImportacao("JSON deve ser uma lista ou um objeto por categoria")
+        return
+
+    try:
+        with open(caminho, encoding="utf-8-sig", newline="") as f:
+            texto = f.read()
+    except UnicodeDecodeError:
+        # Planilha salva pelo Excel em português costuma vir em latin-1
+        with open(caminho, encoding="latin-1", newline="") as f:
+            texto = f.read()
+    # Separador pela primeira linha: Excel em português grava ";", o resto ","
+    primeira = texto.split("\n", 1)[0]
+    separador = next((d for d in ";,\t" if d in primeira), ",")
+    for n, campos in enumerate(csv.reader(texto.splitlines(), delimiter=separador), start=1):
+        if not any(c.strip() for c in campos):
+            continue
+        if n == 1 and [c.strip().lower() for c in campos[:2]] == ["tipo", "nome"]:
+            continue
+        yield n, campos[0] if campos else None, separador.join(campos[1:]) if len(campos) > 1 else None
+
+def ler_cadastro(caminho):
+    """Valida e tira duplicados do arquivo em memória: lista de (tipo, nome) na ordem do arquivo.
+
+    Qualquer linha inválida recusa o arquivo inteiro (ErroImportacao com as
+    primeiras linhas problemáticas): nada é gravado pela metade.
+    """
+    try:
+        brutas = list(_linhas_arquivo(caminho))
+    except (OSError, ValueError) as ex:
+        raise ErroImportacao(f"Arquivo ilegível: {ex}")
+    linhas, vistos, erros = [], set(), []
+    for n, tipo, nome in brutas:
+        tipo = str(tipo or "").strip().lower()
+        nome = " ".join(str(nome or "").split())
+        if tipo not in TIPOS_CADASTRO:
+            erros.append(f"linha {n}: categoria '{tipo}' inválida")
+        elif not nome:
+            erros.append(f"linha {n}: nome vazio")
+        elif len(nome) > CADASTRO_NOME_MAX:
+            erros.append(f"linha {n}: nome com mais de {CADASTRO_NOME_MAX} caracteres")
+        elif (tipo, nome.casefold()) not in vistos:
+            vistos.add((tipo, nome.casefold()))
+            linhas.append((tipo, nome))
+    if erros:
+        extra = f" (+{len(erros) - 3})" if len(erros) > 3 else ""
+        raise ErroImportacao("; ".join(erros[:3]) + extra)
+    if not linhas:
+        raise ErroImportacao("Arquivo sem itens")
+    return linhas
+
+def importar_cadastro(banco, linhas):
+    """Grava numa única transação só o que ainda não existe; devolve {tipo: novos}.
+
+    Os itens do checklist entram no fim da rotina, na ordem do arquivo.
+    """
+    def tarefa(c):
+        existentes = {(tipo, nome.casefold()) for tipo, nome in c.execute("SELECT tipo, nome FROM opcoes")}
+        existentes |= {("rotina", t.casefold()) for t, in c.execute("SELECT titulo FROM rotina_itens")}
+        novos = [(tipo, nome) for tipo, nome in linhas if (tipo, nome.casefold()) not in existentes]
+        base = proxima_ordem(c)
+        rotina = [nome for tipo, nome in novos if tipo == "rotina"]
+        c.executemany("INSERT INTO rotina_itens (titulo, ordem) VALUES (?, ?)",
+                      [(nome, base + i * ORDEM_PASSO) for i, nome in enumerate(rotina)])
+        c.executemany("INSERT INTO opcoes (tipo, nome) VALUES (?, ?)", [l for l in novos if l[0] != "rotina"])
+        contagem = {}
+        for tipo, _ in novos:
+            contagem[tipo] = contagem.get(tipo, 0) + 1
+        return contagem
+    return banco.escrever(tarefa)
+
+def exportar_cadastro(banco, caminho):
+    """CSV no mesmo formato da importação (tipo;nome), linha a linha direto do cursor."""
+    total = 0
+
+    def escrever(temporario):
+        nonlocal total
+        with open(temporario, "w", encoding="utf-8-sig", newline="") as f, banco.leitura() as c:
+            saida = csv.writer(f, delimiter=";")
+            saida.writerow(["tipo", "nome"])
+            for tipo in TIPOS_CADASTRO[:-1]:
+                for nome, in c.execute("SELECT nome FROM opcoes WHERE tipo = ? ORDER BY nome", (tipo,)):
+                    saida.writerow([tipo, nome])
+                    total += 1
+            for titulo, in c.execute("SELECT titulo FROM rotina_itens ORDER BY ordem ASC, id ASC"):
+                saida.writerow(["rotina", titulo])
+                total += 1
+
+    gravar_arquivo(caminho, escrever)
+    return total
+
+# --- MANUTENÇÃO (RETENÇÃO, LIMPEZA E COMPACTAÇÃO) ---
+RETENCAO_DIAS_PADRAO = 365      # relatórios mais velhos que isso saem (0 = sem limite)
+LIMITE_MB_PADRAO = 2048         # teto para relatórios + fotos (0 = sem limite)
+MANUTENCAO_OCIOSO = 120         # segundos sem mexer na tela antes de rodar
+MANUTENCAO_INTERVALO = 6 * 3600
+VACUUM_PAGINAS = 2000           # páginas devolvidas por incremental_vacuum a cada rodada
+
+def configuracao(banco, chave, padrao):
+    linha = banco.ler_um("SELECT valor FROM configuracao WHERE chave = ?", (chave,))
+    if linha is None:
+        return padrao
+    try:
+        return type(padrao)(linha[0])
+    except (TypeError, ValueError):
+        return padrao
+
+def salvar_configuracao(banco, chave, valor):
+    banco.executar("INSERT OR REPLACE INTO configuracao (chave, valor) VALUES (?, ?)", (chave, str(valor)))
+
+def tamanho_arquivo(caminho):
+    try:
+        return os.path.getsize(caminho)
+    except OSError:
+        return 0
+
+def formatar_bytes(n):
+    for unidade in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unidade}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+class Manutencao:
+    """Mantém o armazenamento do tablet sob controle, em segundo plano.
+
+    Quando a interface fica parada por MANUTENCAO_OCIOSO segundos (no máximo uma
+    vez a cada MANUTENCAO_INTERVALO) aplica a retenção e o limite de disco aos
+    relatórios, apaga fotos que nenhuma rota ou rascunho usa e rascunhos de
+    itens que saíram do checklist, enxuga o log da sincronização
+    (compactar_alteracoes), devolve páginas livres do banco (incremental_vacuum)
+    e roda ANALYZE.
+
+    Só apaga arquivos que o app criou e consegue refazer: PDFs de rotas com
+    execução salva no banco (regerados ao serem abertos no histórico) e lotes
+    exportados, do mais antigo para o mais novo. Relatórios antigos, de antes das
+    execuções, e as fotos das rotas salvas são dados originais: nunca são
+    removidos, só entram na conta do espaço usado.
+    """
+
+    def __init__(self, banco, fotos, ocioso=MANUTENCAO_OCIOSO, intervalo=MANUTENCAO_INTERVALO):
+        self._banco = banco
+        self._fotos = fotos
+        self.pasta = os.path.dirname(banco.caminho)
+        self.ocioso = ocioso
+        self.intervalo = intervalo
+        self._ultimo_uso = time.monotonic()
+        self._ultima = None
+        self._lock = threading.Lock()  # uma rodada por vez (automática ou pelo botão)
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="manutencao", daemon=True)
+        self._thread.start()
+
+    def tocar(self):
+        # Chamado a cada atualização da tela: só marca que alguém está usando
+        self._ultimo_uso = time.monotonic()
+
+    def limites(self):
+        return (configuracao(self._banco, "retencao_dias", RETENCAO_DIAS_PADRAO),
+                configuracao(self._banco, "limite_mb", LIMITE_MB_PADRAO))
+
+    def _relatorios(self):
+        """[(mtime, bytes, caminho, removivel)] dos arquivos gerados pelo app."""
+        regeneraveis, antigos = set(), set()
+        for info, com_execucao in self._banco.ler(
+                "SELECT DISTINCT info, execucao_id IS NOT NULL FROM historico WHERE info IS NOT NULL"):
+            (regeneraveis if com_execucao else antigos).add(info)
+        arquivos = []
+        with os.scandir(self.pasta) as entradas:
+            for entrada in entradas:
+                nome = entrada.name
+                lote = nome.startswith("lote_") and nome.endswith((".pdf", ".zip"))
+                if (lote or nome in regeneraveis or nome in antigos) and entrada.is_file():
+                    st = entrada.stat()
+                    # Nome também usado por um registro antigo: sem execução, não dá para refazer
+                    removivel = lote or nome not in antigos
+                    arquivos.append((st.st_mtime, st.st_size, entrada.path, removivel))
+        return arquivos
+
+    def _fotos_removiveis(self):
+        """[(criado_em, bytes, hash)] das fotos que nenhum rascunho aberto ou rota salva usa."""
+        linhas = self._banco.ler(
+            "SELECT hash, criado_em FROM fotos WHERE hash NOT IN (SELECT hash FROM rascunho_fotos) "
+            "AND hash NOT IN (SELECT hash FROM execucao_fotos) ORDER BY criado_em")
+        resultado = []
+        for digest, criado_em in linhas:
+            tamanho = tamanho_arquivo(self._fotos.caminho(digest)) + tamanho_arquivo(self._fotos.caminho_miniatura(digest))
+            resultado.append((criado_em or "", tamanho, digest))
+        return resultado
+
+    def _bytes_fotos(self):
+        total = 0
+        with os.scandir(self._fotos.pasta) as entradas:
+            for entrada in entradas:
+                if entrada.is_file():
+                    total += entrada.stat().st_size
+        return total
+
+    def uso(self):
+        """Bytes por categoria, para a tela de administração."""
+        banco = sum(tamanho_arquivo(self._banco.caminho + sufixo) for sufixo in ("", "-wal", "-shm"))
+        livres = self._banco.ler_um("PRAGMA freelist_count")[0] * self._banco.ler_um("PRAGMA page_size")[0]
+        fotos = self._bytes_fotos()
+        relatorios = sum(r[1] for r in self._relatorios())
+        try:
+            disco_livre = shutil.disk_usage(self.pasta).free
+        except OSError:
+            disco_livre = None
+        return {"banco": banco, "banco_livre": livres, "relatorios": relatorios, "fotos": fotos, "disco_livre": disco_livre}
+
+    def executar(self):
+        """Uma rodada completa; devolve um resumo do que foi feito."""
+        with self._lock:
+            resumo = {"rascunhos": self._podar_rascunhos()}
+            resumo.update(self._aplicar_limites())
+            resumo["log"] = self._banco.escrever(compactar_alteracoes)
+            resumo["paginas"] = self._compactar()
+            self._ultima = time.monotonic()
+            return resumo
+
+    def _podar_rascunhos(self):
+        # Observações e fotos de rascunho de itens que foram removidos do checklist
+        def tarefa(c):
+            c.execute("""DELETE FROM rascunho WHERE id GLOB 'obs_[0-9]*'
+                AND CAST(substr(id, 5) AS INTEGER) NOT IN (SELECT id FROM rotina_itens)""")
+            n = c.rowcount
+            c.execute("""DELETE FROM rascunho_fotos WHERE secao GLOB '[0-9]*'
+                AND CAST(secao AS INTEGER) NOT IN (SELECT id FROM rotina_itens)""")
+            return n + c.rowcount
+        return self._banco.escrever(tarefa)
+
+    def _aplicar_limites(self):
+        retencao_dias, limite_mb = self.limites()
+        relatorios = sorted(self._relatorios())
+        removiveis = [r for r in relatorios if r[3]]
+        # Foto de rota salva é dado original (não dá para refazer) e nunca sai;
+        # as que nenhuma rota ou rascunho usa não servem para nada
+        apagar_rel, apagar_fotos = [], self._fotos_removiveis()
+        if retencao_dias > 0:
+            corte = time.time() - retencao_dias * 86400
+            apagar_rel += [r for r in removiveis if r[0] < corte]
+        if limite_mb > 0:
+            escolhidos = {r[2] for r in apagar_rel}
+            total = self._bytes_fotos() + sum(r[1] for r in relatorios) - sum(r[1] for r in apagar_rel) - sum(f[1] for f in apagar_fotos)
+            excesso = total - limite_mb * 1024 * 1024
+            for r in removiveis:
+                if excesso <= 0:
+                    break
+                if r[2] not in escolhidos:
+                    apagar_rel.append(r)
+                    excesso -= r[1]
+
+        liberados = 0
+        for _, tamanho, caminho, _ in apagar_rel:
+            try:
+                os.remove(caminho)
+                liberados += tamanho
+            except OSError:
+                pass
+        if apagar_fotos:
+            hashes = [f[2] for f in apagar_fotos]
+            # Primeiro o banco: uma foto nunca fica registrada sem o arquivo
+            self._banco.escrever(lambda c: c.executemany(
+                "DELETE FROM fotos WHERE hash = ? AND hash NOT IN (SELECT hash FROM rascunho_fotos) "
+                "AND hash NOT IN (SELECT hash FROM execucao_fotos)", [(h,) for h in hashes]))
+            for _, tamanho, digest in apagar_fotos:
+                if self._banco.ler_um("SELECT 1 FROM fotos WHERE hash = ?", (digest,)):
+                    continue  # voltou para um rascunho ou rota nesse meio tempo
+                for caminho in (self._fotos.caminho(digest), self._fotos.caminho_miniatura(digest)):
+                    try:
+                        os.remove(caminho)
+                    except OSError:
+                        pass
+                liberados += tamanho
+        return {"relatorios": len(apagar_rel), "fotos": len(apagar_fotos), "bytes": liberados}
+
+    def _compactar(self):
+        def tarefa(c):
+            modo = c.execute("PRAGMA auto_vacuum").fetchone()[0]
+            livres = c.execute("PRAGMA freelist_count").fetchone()[0]
+            if modo != 2:
+                # Banco criado sem auto_vacuum: um VACUUM completo, uma vez, liga o modo incremental
+                c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                c.execute("VACUUM")
+            elif livres:
+                # executescript roda o pragma até o fim; um execute() só avança um passo (uma página)
+                c.connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGINAS});")
+            c.execute("ANALYZE")
+            c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return livres
+        return self._banco.escrever(tarefa, transacao=False)
+
+    def _loop(self):
+        while not self._parar.wait(30):
+            agora = time.monotonic()
+            if agora - self._ultimo_uso < self.ocioso:
+                continue
+            if self._ultima is not None and agora - self._ultima < self.intervalo:
+                continue
+            try:
+                self.executar()
+            except Exception as ex:
+                diagnostico.erro("manutencao", ex)
+                self._ultima = time.monotonic()
+
+    def fechar(self):
+        self._parar.set()
+
+# --- SINCRONIZAÇÃO COM O COLETOR CENTRAL ---
+SYNC_LOTE = 500                 # alterações por requisição
+SYNC_LOTE_FOTOS = 50            # rotas por consulta de fotos faltando
+SYNC_TIMEOUT = 20
+SYNC_INTERVALO = 15 * 60
+SYNC_LAPIDE_DIAS = 180          # lápides já trocadas com o coletor saem do log depois disso
+# O que vem do coletor é só a configuração; rotas finalizadas só sobem
+SYNC_TABELAS_RECEBIDAS = ("opcoes", "rotina_itens")
+
+def _registro_sync(c, tabela, uid):
+    """(dados, alterado_em) do estado atual do registro, ou None se ele não existe mais."""
+    if tabela == "opcoes":
+        r = c.execute("SELECT tipo, nome, alterado_em FROM opcoes WHERE uid = ?", (uid,)).fetchone()
+        return r and ({"tipo": r[0], "nome": r[1]}, r[2])
+    if tabela == "rotina_itens":
+        r = c.execute("SELECT titulo, ordem, alterado_em FROM rotina_itens WHERE uid = ?", (uid,)).fetchone()
+        return r and ({"titulo": r[0], "ordem": r[1]}, r[2])
+    r = c.execute("SELECT id, data, lider, maquina, turma, rota, arquivo, criado_em FROM execucoes WHERE uid = ?", (uid,)).fetchone()
+    if not r:
+        return None
+    fotos = {}
+    for item_id, h in c.execute("SELECT item_id, hash FROM execucao_fotos WHERE execucao_id = ? ORDER BY rowid", (r[0],)):
+        fotos.setdefault(item_id, []).append(h)
+    itens = [{"item_id": item_id, "titulo": titulo, "obs": obs, "fotos": fotos.get(item_id, [])}
+             for item_id, titulo, obs in c.execute(
+                 "SELECT item_id, titulo, observacao FROM execucao_itens WHERE execucao_id = ? ORDER BY ordem", (r[0],))]
+    dados = {"data": r[1], "lider": r[2], "maquina": r[3], "turma": r[4], "rota": r[5], "arquivo": r[6], "itens": itens}
+    return dados, r[7]
+
+# Colunas trocadas entre aparelhos e a chave natural usada para reconhecer o mesmo registro
+SYNC_CAMPOS = {"opcoes": ("tipo", "nome"), "rotina_itens": ("titulo", "ordem")}
+SYNC_CHAVE_NATURAL = {"opcoes": ("tipo = ? AND nome = ? COLLATE NOCASE", ("tipo", "nome")),
+                      "rotina_itens": ("titulo = ? COLLATE NOCASE", ("titulo",))}
+
+def _mais_nova(quando, dados, local_quando, local_dados):
+    # Desempate pelo conteúdo: todos os aparelhos escolhem a mesma versão
+    return (quando, json.dumps(dados, sort_keys=True)) > (local_quando or "", json.dumps(local_dados, sort_keys=True))
+
+def aplicar_alteracoes(c, alteracoes):
+    """Aplica no banco local o que veio do coletor (roda na thread de escrita).
+
+    Regras de conflito, iguais em todos os aparelhos:
+    - por registro, vence a alteração mais recente (alterado_em; empate: pelo conteúdo);
+    - apagar é uma alteração como outra: lápide mais nova (ou da mesma hora) impede a
+      volta do registro;
+    - registro novo com o mesmo nome/título de um local é o mesmo registro: os dois
+      aparelhos passam a usar o menor uid;
+    - ordem do checklist: mover grava só o rank do item movido, então movimentos de
+      itens diferentes em aparelhos diferentes se somam; se dois itens acabam com o
+      mesmo rank, os de maior uid vão para logo depois e isso é registrado como
+      alteração local, para os outros aparelhos convergirem.
+    Devolve os uids de rotina_itens gravados.
+    """
+    gravados = []
+    c.execute("INSERT INTO sync_aplicando (ativo) VALUES (1)")
+    for a in alteracoes:
+        tabela, uid, quando = a["tabela"], a["uid"], a["alterado_em"]
+        if tabela not in SYNC_TABELAS_RECEBIDAS:
+            continue
+        campos = SYNC_CAMPOS[tabela]
+        colunas = ", ".join(campos)
+        local = c.execute(f"SELECT id, uid, alterado_em, {colunas} FROM {tabela} WHERE uid = ?", (uid,)).fetchone()
+        if a["operacao"] == "apagar":
+            if local and (local[2] or "") <= quando:
+                c.execute(f"DELETE FROM {tabela} WHERE id = ?", (local[0],))
+            c.execute("INSERT INTO alteracoes (tabela, uid, operacao, alterado_em, remoto) VALUES (?, ?, 'apagar', ?, 1)",
+                      (tabela, uid, quando))
+            continue
+        dados = {campo: a["dados"][campo] for campo in campos}
+        if local is None:
+            lapide = c.execute("SELECT MAX(alterado_em) FROM alteracoes WHERE tabela = ? AND uid = ? AND operacao = 'apagar'",
+                               (tabela, uid)).fetchone()[0]
+            if lapide and lapide >= quando:
+                continue
+            condicao, chave = SYNC_CHAVE_NATURAL[tabela]
+            local = c.execute(f"SELECT id, uid, alterado_em, {colunas} FROM {tabela} WHERE {condicao}",
+                              [dados[campo] for campo in chave]).fetchone()
+            if local:
+                if uid > local[1]:
+                    continue  # o outro aparelho é que vai adotar o nosso uid
+                c.execute(f"UPDATE {tabela} SET uid = ? WHERE id = ?", (uid, local[0]))
+                if not _mais_nova(quando, dados, local[2], dict(zip(campos, local[3:]))):
+                    # A versão local é que vence: sobe de novo, agora com o uid comum
+                    c.execute("INSERT INTO alteracoes (tabela, uid, operacao) VALUES (?, ?, 'gravar')", (tabela, uid))
+        if local is None:
+            c.execute(f"INSERT INTO {tabela} ({colunas}, uid, alterado_em) VALUES (?, ?, ?, ?)", (*dados.values(), uid, quando))
+        elif _mais_nova(quando, dados, local[2], dict(zip(campos, local[3:]))):
+            atribuicoes = ", ".join(f"{campo} = ?" for campo in campos)
+            c.execute(f"UPDATE {tabela} SET {atribuicoes}, alterado_em = ? WHERE id = ?", (*dados.values(), quando, local[0]))
+        else:
+            continue
+        if tabela == "rotina_itens":
+            gravados.append(uid)
+    c.execute("DELETE FROM sync_aplicando")
+
+    # Empates de rank: fora do modo de aplicação, então o ajuste vai para o log
+    for uid in gravados:
+        item = c.execute("SELECT ordem FROM rotina_itens WHERE uid = ?", (uid,)).fetchone()
+        empatados = c.execute("SELECT id FROM rotina_itens WHERE ordem = ? ORDER BY uid", (item[0],)).fetchall() if item else []
+        for (item_id,) in empatados[1:]:
+            ordem = c.execute("SELECT ordem FROM rotina_itens WHERE id = ?", (item_id,)).fetchone()[0]
+            seguinte = c.execute("SELECT MIN(ordem) FROM rotina_itens WHERE ordem > ?", (ordem,)).fetchone()[0]
+            if seguinte is None:
+                c.execute("UPDATE rotina_itens SET ordem = ? WHERE id = ?", (ordem + ORDEM_PASSO, item_id))
+            elif seguinte - ordem >= 2:
+                c.execute("UPDATE rotina_itens SET ordem = ? WHERE id = ?", ((ordem + seguinte) // 2, item_id))
+            else:
+                rebalancear_ordem(c)
+                break
+    return gravados
+
+def compactar_alteracoes(c, dias_lapide=SYNC_LAPIDE_DIAS):
+    """Enxuga o log local sem mudar o que os outros aparelhos vão receber.
+
+    - gravação ainda não enviada seguida de outra alteração local do mesmo registro:
+      o envio manda o estado atual de qualquer forma, então só a última fica;
+    - lápide com mais de `dias_lapide` dias que já foi enviada ou veio do coletor;
+    - sem nada trocado com um coletor até hoje, nenhum outro aparelho conhece os
+      registros apagados e as lápides não protegem nada.
+    Roda na thread de escrita (manutenção); devolve quantas linhas saíram.
+    """
+    c.execute("""DELETE FROM alteracoes WHERE operacao = 'gravar' AND remoto = 0 AND EXISTS (
+        SELECT 1 FROM alteracoes b WHERE b.tabela = alteracoes.tabela AND b.uid = alteracoes.uid
+            AND b.seq > alteracoes.seq AND b.remoto = 0)""")
+    removidas = c.rowcount
+    cursores = dict(c.execute("SELECT chave, CAST(valor AS INTEGER) FROM configuracao "
+                              "WHERE chave IN ('sync_enviado', 'sync_recebido')").fetchall())
+    enviado = cursores.get("sync_enviado") or 0
+    if not enviado and not cursores.get("sync_recebido"):
+        c.execute("DELETE FROM alteracoes WHERE operacao = 'apagar'")
+    else:
+        c.execute("DELETE FROM alteracoes WHERE operacao = 'apagar' AND (remoto = 1 OR seq <= ?) "
+                  "AND alterado_em < strftime('%Y-%m-%dT%H:%M:%f', 'now', ?)", (enviado, f"{-int(dias_lapide)} days"))
+    return removidas + c.rowcount
+
+class ErroSincronizacao(Exception):
+    pass
+
+class Sincronizador:
+    """Troca alterações com o coletor central (coletor.py) por HTTP, sem travar o app.
+
+    Funciona offline: as alterações ficam no log local (tabela alteracoes) até
+    haver rede. Cada envio ou recebimento é um lote comprimido (gzip) e o cursor
+    de cada lado só avança na mesma transação que grava o lote, então uma
+    sincronização interrompida continua de onde parou. As fotos sobem uma a uma,
+    só as que o coletor ainda não tem (o nome é o hash).
+    """
+
+    def __init__(self, banco, fotos, ao_receber=None, intervalo=SYNC_INTERVALO):
+        self._banco = banco
+        self._fotos = fotos
+        self._ao_receber = ao_receber
+        self.intervalo = intervalo
+        self.ultimo = None       # resumo da última tentativa, para o admin
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="sincronizacao", daemon=True)
+        self._thread.start()
+
+    def url(self):
+        return configuracao(self._banco, "coletor_url", os.environ.get("FITESA_COLETOR", "")).rstrip("/")
+
+    def dispositivo(self):
+        atual = configuracao(self._banco, "dispositivo", "")
+        if not atual:
+            atual = uuid.uuid4().hex
+            self._banco.escrever(lambda c: c.execute(
+                "INSERT OR IGNORE INTO configuracao (chave, valor) VALUES ('dispositivo', ?)", (atual,)))
+            atual = configuracao(self._banco, "dispositivo", atual)
+        return atual
+
+    def pendentes(self):
+        enviado = configuracao(self._banco, "sync_enviado", 0)
+        return self._banco.ler_um("SELECT COUNT(*) FROM alteracoes WHERE seq > ? AND remoto = 0", (enviado,))[0]
+
+    def agendar(self):
+        self._acordar.set()
+
+    def _requisicao(self, caminho, corpo=None, metodo=None, bruto=None):
+        dados, cabecalhos = None, {"Accept-Encoding": "gzip"}
+        if corpo is not None:
+            dados = gzip.compress(json.dumps(corpo, ensure_ascii=False).encode("utf-8"))
+            cabecalhos.update({"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        elif bruto is not None:
+            dados = bruto
+            cabecalhos["Content-Type"] = "application/octet-stream"
+        pedido = urllib.request.Request(self.url() + caminho, data=dados, headers=cabecalhos, method=metodo)
+        with urllib.request.urlopen(pedido, timeout=SYNC_TIMEOUT) as resposta:
+            conteudo = resposta.read()
+            if resposta.headers.get("Content-Encoding") == "gzip":
+                conteudo = gzip.decompress(conteudo)
+        return json.loads(conteudo) if conteudo else {}
+
+    def _enviar(self, dispositivo):
+        total = 0
+        while True:
+            enviado = configuracao(self._banco, "sync_enviado", 0)
+            with self._banco.leitura() as c:
+                linhas = c.execute("SELECT seq, tabela, uid, operacao, alterado_em FROM alteracoes "
+                                   "WHERE seq > ? AND remoto = 0 ORDER BY seq LIMIT ?", (enviado, SYNC_LOTE)).fetchall()
+                if not linhas:
+                    return total
+                # Várias alterações do mesmo registro no lote viram uma só, com o estado atual
+                ultimas = {}
+                for seq, tabela, uid, operacao, quando in linhas:
+                    ultimas.pop((tabela, uid), None)
+                    ultimas[(tabela, uid)] = (seq, operacao, quando)
+                lote = []
+                for (tabela, uid), (seq, operacao, quando) in ultimas.items():
+                    alteracao = {"seq": seq, "tabela": tabela, "uid": uid, "operacao": operacao, "alterado_em": quando, "dados": None}
+                    if operacao == "gravar":
+                        registro = _registro_sync(c, tabela, uid)
+                        if registro is None:
+                            continue  # apagado depois: a lápide vem em seguida no log
+                        alteracao["dados"], alteracao["alterado_em"] = registro[0], registro[1] or quando
+                    lote.append(alteracao)
+            ate = linhas[-1][0]
+            if lote:
+                self._requisicao("/sync/push", {"dispositivo": dispositivo, "ate": ate, "alteracoes": lote})
+
+            def confirmar(c):
+                c.execute("INSERT OR REPLACE INTO configuracao (chave, valor) VALUES ('sync_enviado', ?)", (str(ate),))
+                # Gravações enviadas não precisam mais ficar no log; as lápides ficam
+                c.execute("DELETE FROM alteracoes WHERE seq <= ? AND operacao = 'gravar'", (ate,))
+            self._banco.escrever(confirmar)
+            total += len(lote)
+
+    def _receber(self, dispositivo):
+        total = 0
+        while True:
+            desde = configuracao(self._banco, "sync_recebido", 0)
+            consulta = urllib.parse.urlencode({"desde": desde, "dispositivo": dispositivo, "limite": SYNC_LOTE})
+            resposta = self._requisicao(f"/sync/pull?{consulta}")
+            alteracoes, ate = resposta.get("alteracoes", []), resposta.get("ate", desde)
+
+            def gravar(c):
+                aplicar_alteracoes(c, alteracoes)
+                c.execute("INSERT OR REPLACE INTO configuracao (chave, valor) VALUES ('sync_recebido', ?)", (str(ate),))
+            self._banco.escrever(gravar)
+            total += len(alteracoes)
+            if not resposta.get("mais"):
+                return total
+
+    def _enviar_fotos(self):
+        total = 0
+        while True:
+            cursor = configuracao(self._banco, "sync_fotos", 0)
+            ids = [r[0] for r in self._banco.ler("SELECT id FROM execucoes WHERE id > ? ORDER BY id LIMIT ?", (cursor, SYNC_LOTE_FOTOS))]
+            if not ids:
+                return total
+            hashes = [r[0] for r in self._banco.ler(
+                "SELECT DISTINCT hash FROM execucao_fotos WHERE execucao_id BETWEEN ? AND ?", (ids[0], ids[-1]))]
+            if hashes:
+                for digest in self._requisicao("/fotos/faltando", {"hashes": hashes}).get("faltando", []):
+                    caminho = self._fotos.caminho(digest)
+                    if not os.path.exists(caminho):
+                        continue  # arquivo perdido no aparelho: a rota sobe sem ela
+                    with open(caminho, "rb") as f:
+                        self._requisicao(f"/fotos/{digest}", metodo="PUT", bruto=f.read())
+                    total += 1
+            salvar_configuracao(self._banco, "sync_fotos", ids[-1])
+
+    def sincronizar(self):
+        """Envia, recebe e sobe fotos; devolve o resumo. Erros de rede são repassados."""
+        if not self.url():
+            raise ErroSincronizacao("Endereço do coletor não configurado")
+        with self._lock:
+            inicio = time.perf_counter()
+            try:
+                dispositivo = self.dispositivo()
+                resumo = {"enviadas": self._enviar(dispositivo), "recebidas": self._receber(dispositivo),
+                          "fotos": self._enviar_fotos()}
+                if resumo["recebidas"] and self._ao_receber:
+                    self._ao_receber()
+                resumo["erro"] = None
+            except (OSError, ValueError) as ex:
+                resumo = {"enviadas": 0, "recebidas": 0, "fotos": 0, "erro": str(ex)}
+                self.ultimo = {**resumo, "quando": datetime.datetime.now().isoformat(timespec="seconds")}
+                raise
+            resumo["ms"] = round((time.perf_counter() - inicio) * 1000)
+            self.ultimo = {**resumo, "quando": datetime.datetime.now().isoformat(timespec="seconds")}
+            return resumo
+
+    def _loop(self):
+        while not self._parar.is_set():
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            if self._parar.is_set() or not self.url():
+                continue
+            try:
+                self.sincronizar()
+            except Exception as ex:
+                # Sem rede é o normal no chão de fábrica: tenta de novo no próximo ciclo
+                diagnostico.erro("sincronizacao", ex)
+
+    def fechar(self):
+        self._parar.set()
+        self._acordar.set()
+
+# --- RECURSOS DO PROCESSO E SESSÕES ---
+def abrir_recursos():
+    global db_path, banco, catalogo, fotos, manutencao, sincronizador
+    with _init_lock:
+        if banco is not None:
+            return
+        rota_base = os.environ.get("HOME")
+        if not rota_base:
+            rota_base = os.getcwd()
+        db_path = os.path.join(rota_base, "fitesa_rotas.db")
+
+        # Tabelas: só roda algo quando o user_version do banco está atrasado
+        conexao = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            conexao.execute("PRAGMA journal_mode=WAL")
+            migrar(conexao)
+        finally:
+            conexao.close()
+
+        banco = BancoSQLite(db_path)
+        catalogo = CatalogoOpcoes(banco)
+        fotos = FotoStore(banco)
+        manutencao = Manutencao(banco, fotos)
+        sincronizador = Sincronizador(banco, fotos, ao_receber=catalogo.invalidar)
+
+def identificar_sessao(page):
+    if not MODO_SERVIDOR:
+        return ""
+    # Guardado no navegador: o líder que recarrega a página continua com o seu rascunho
+    try:
+        sessao = page.client_storage.get("fitesa.sessao")
+        if not sessao:
+            sessao = uuid.uuid4().hex
+            page.client_storage.set("fitesa.sessao", sessao)
+        return sessao
+    except Exception:
+        return page.session_id
+
+def encerrar():
+    """Grava os rascunhos de todas as sessões e fecha o banco (saída do processo)."""
+    global banco, catalogo, fotos, manutencao, sincronizador
+    for rascunhos in list(sessoes.values()):
+        rascunhos.fechar()
+    sessoes.clear()
+    with _init_lock:
+        if sincronizador:
+            sincronizador.fechar()
+        if manutencao:
+            manutencao.fechar()
+        if fotos:
+            fotos.fechar()
+        if banco:
+            banco.fechar()
+        banco = catalogo = fotos = manutencao = sincronizador = None
+
+atexit.register(encerrar)
+
+# --- CONTROLES ---
+class LinhaChecklist(ft.DragTarget):
+    """Linha arrastável do checklist no admin.
+
+    Isolada: ao atualizar a lista o Flet compara só a linha, sem descer no card
+    de cada item. Mover um item custa a troca de posição de uma linha, e não o
+    diff de todos os controles da aba.
+    """
+
+    def is_isolated(self):
+        return True
 
 def main(page: ft.Page):
+    t_inicio = time.perf_counter()
     # ==============================================================================
     # 1. TELA DE CARREGAMENTO (ANTI-TELA BRANCA)
     # ==============================================================================
@@ -45,48 +1902,18 @@ def main(page: ft.Page):
     )
 
     page.add(loading_screen)
-    page.update()
-    time.sleep(0.5) # Tempo para o Android renderizar
 
     # ==============================================================================
     # 2. INICIALIZAÇÃO BLINDADA DO BANCO DE DADOS
     # ==============================================================================
     try:
-        # A. Caminhos
-        status_txt.value = "Verificando armazenamento..."
-        page.update()
-        
-        rota_base = os.environ.get("HOME")
-        if not rota_base:
-            rota_base = os.getcwd()
-        
-        global db_path, conn, cursor
-        db_path = os.path.join(rota_base, "fitesa_rotas.db")
+        # Banco, catálogo e fotos são do processo; em modo servidor a primeira sessão os abre
+        abrir_recursos()
 
-        # B. Conexão
-        status_txt.value = "Conectando ao banco..."
-        page.update()
-        
-        conn = sqlite3.connect(db_path, check_same_thread=False)
-        cursor = conn.cursor()
-        
-        # C. Tabelas
-        cursor.execute("CREATE TABLE IF NOT EXISTS opcoes (id INTEGER PRIMARY KEY, tipo TEXT, nome TEXT)")
-        cursor.execute("CREATE TABLE IF NOT EXISTS rotina_itens (id INTEGER PRIMARY KEY, titulo TEXT)")
-        cursor.execute("CREATE TABLE IF NOT EXISTS historico (id INTEGER PRIMARY KEY, data TEXT, info TEXT)")
-        cursor.execute("CREATE TABLE IF NOT EXISTS rascunho (id TEXT PRIMARY KEY, valor TEXT)")
-        
-        # Migração segura (coluna ordem)
-        try:
-            cursor.execute("SELECT ordem FROM rotina_itens LIMIT 1")
-        except sqlite3.OperationalError:
-            cursor.execute("ALTER TABLE rotina_itens ADD COLUMN ordem INTEGER DEFAULT 0")
-            conn.commit()
-            
-        conn.commit()
-        status_txt.value = "Sistema carregado!"
-        page.update()
-        time.sleep(0.5)
+        # O resto é da sessão: rascunhos e estado do formulário não se misturam entre líderes
+        rascunhos = RascunhoStore(banco, identificar_sessao(page))
+        rascunhos.carregar()
+        sessoes[page.session_id] = rascunhos
 
     except Exception as e:
         # TELA DE ERRO (EM VEZ DE TELA BRANCA)
@@ -108,24 +1935,50 @@ def main(page: ft.Page):
     # ==============================================================================
     
     # Variáveis de Estado
-    user_data = {"fotos": {}}
+    miniaturas = {}  # secao -> Row de miniaturas da linha montada na tela da rota
     current_nav_index = 0
+    versao_dropdowns = 0  # versão do catálogo já carregada nos dropdowns da rota
 
     # --- Helpers de Banco de Dados ---
     def save_draft(key, value):
-        try:
-            if conn:
-                conn.cursor().execute("INSERT OR REPLACE INTO rascunho (id, valor) VALUES (?, ?)", (key, str(value)))
-                conn.commit()
-        except: pass
+        # Só atualiza a memória; o RascunhoStore grava em lote
+        rascunhos.set(key, str(value))
 
     def get_draft(key):
+        return rascunhos.get(key)
+
+    def flush_drafts(e=None):
+        rascunhos.flush()
+
+    def fechar_sessao(e=None):
+        sessoes.pop(page.session_id, None)
+        rascunhos.fechar()
+
+    # Encerramento / app em segundo plano: garante que nada fica só na memória
+    page.on_app_lifecycle_state_change = flush_drafts
+    page.on_disconnect = flush_drafts
+    page.on_close = fechar_sessao
+
+    # --- Diagnóstico: tempo de cada update e de cada tela ---
+    atualizar_pagina = page.update
+
+    def update_medido(*controles):
+        # Também pega o control.update(), que passa pelo page.update; a manutenção
+        # usa a mesma chamada para saber que a tela está em uso
+        if manutencao:
+            manutencao.tocar()
+        if not diagnostico.ativo:
+            return atualizar_pagina(*controles)
+        t0 = time.perf_counter()
         try:
-            if conn:
-                res = conn.cursor().execute("SELECT valor FROM rascunho WHERE id = ?", (key,)).fetchone()
-                return res[0] if res else ""
-            return ""
-        except: return ""
+            return atualizar_pagina(*controles)
+        finally:
+            nome = ", ".join(sorted({type(c).__name__ for c in controles})) or "Page"
+            diagnostico.registrar("update", nome, (time.perf_counter() - t0) * 1000)
+    page.update = update_medido
+
+    def medir_tela(funcao):
+        return diagnostico.tela(page, funcao)
 
     # --- Componentes Visuais ---
     def criar_card(titulo, conteudo, icone=None):
@@ -168,88 +2021,125 @@ def main(page: ft.Page):
     date_picker.on_change = on_date_change
     txt_data.on_focus = lambda _: date_picker.pick_date()
 
+    # Filtros de data do histórico (on_change trocado conforme o campo escolhido)
+    seletor_historico = ft.DatePicker(first_date=datetime.datetime(2023, 1, 1), last_date=datetime.datetime(2030, 12, 31))
+    page.overlay.append(seletor_historico)
+
     dd_lider = ft.Dropdown(label="Líder", border_radius=10, expand=True, on_change=lambda e: save_draft("lider", e.control.value))
     dd_maquina = ft.Dropdown(label="Máquina", border_radius=10, expand=True, on_change=lambda e: save_draft("maquina", e.control.value))
     dd_turma = ft.Dropdown(label="Turma", border_radius=10, expand=True, on_change=lambda e: save_draft("turma", e.control.value))
     dd_rota = ft.Dropdown(label="Rota", border_radius=10, expand=True, on_change=lambda e: save_draft("rota", e.control.value))
 
     # --- Câmera ---
+    # Quem abriu o seletor para algo que não é foto (importação do admin) deixa o tratamento aqui
+    pedido_arquivo = {}
+
     def on_file_result(e: ft.FilePickerResultEvent):
+        tratar = pedido_arquivo.pop("tratar", None)
+        if tratar:
+            tratar(e)
+            return
         if e.files:
             secao = page.session.get("current_section")
             if secao:
-                user_data["fotos"][secao] = e.files[0].path
-                page.snack_bar = ft.SnackBar(ft.Text(f"Foto salva!"), bgcolor="green")
-                page.open(page.snack_bar)
-                page.update()
+                def pronta(digest, erro):
+                    if erro:
+                        page.snack_bar = ft.SnackBar(ft.Text(f"Erro na foto: {erro}"), bgcolor="red")
+                    else:
+                        page.snack_bar = ft.SnackBar(ft.Text(f"Foto salva!"), bgcolor="green")
+                        linha = miniaturas.get(secao)
+                        if linha is not None and linha.page:
+                            linha.controls.append(criar_miniatura(fotos.caminho_miniatura(digest)))
+                            linha.visible = True
+                            linha.update()
+                    page.open(page.snack_bar)
+                    page.update()
+                fotos.adicionar(rascunhos.sessao, secao, e.files[0].path, pronta)
+
+    def criar_miniatura(caminho):
+        return ft.Image(src=caminho, width=56, height=56, fit=ft.ImageFit.COVER, border_radius=6)
     
     file_picker = ft.FilePicker(on_result=on_file_result)
     page.overlay.append(file_picker)
 
     # --- PDF ---
+    pdf_em_andamento = threading.Event()
+
     def gerar_pdf(e):
-        if not fpdf_disponivel:
+        if not fpdf_disponivel():
             page.snack_bar = ft.SnackBar(ft.Text("Erro: Biblioteca FPDF ausente"), bgcolor="red")
             page.open(page.snack_bar)
             return
+        if pdf_em_andamento.is_set():
+            return
         
+        flush_drafts()
+        rascunhos.carregar()
         try:
-            from fpdf import FPDF
-            pdf = FPDF()
-            pdf.add_page()
-            
-            pdf.set_font("Arial", 'B', 16)
-            pdf.cell(0, 10, txt="RELATORIO DE ROTA FITESA", ln=True, align='C')
-            pdf.set_font("Arial", size=12)
-            pdf.ln(5)
-            
-            pdf.cell(0, 10, txt=f"Data: {txt_data.value}", ln=True)
-            pdf.cell(0, 10, txt=f"Lider: {dd_lider.value} | Turma: {dd_turma.value}", ln=True)
-            pdf.cell(0, 10, txt=f"Maquina: {dd_maquina.value} | Rota: {dd_rota.value}", ln=True)
-            pdf.ln(5)
-            pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-            pdf.ln(5)
-            
-            c = conn.cursor()
-            itens = c.execute("SELECT titulo FROM rotina_itens ORDER BY ordem ASC, id ASC").fetchall()
-            
-            if not itens:
-                pdf.cell(0, 10, txt="Nenhum item cadastrado.", ln=True)
-            else:
-                for item in itens:
-                    t = item[0]
-                    obs = get_draft(f"obs_{t}")
-                    pdf.set_font("Arial", 'B', 12)
-                    pdf.cell(0, 8, txt=f"- {t}", ln=True)
-                    if obs:
-                        pdf.set_font("Arial", size=11)
-                        pdf.multi_cell(0, 6, txt=f"  Obs: {obs}")
-                    else:
-                        pdf.set_font("Arial", 'I', 10)
-                        pdf.cell(0, 6, txt="  (Sem observacoes)", ln=True)
-                    pdf.ln(2)
-
-            nome_arq = f"{txt_data.value.replace('/', '_')}_{dd_turma.value}.pdf"
-            caminho_final = os.path.join(os.path.dirname(db_path), nome_arq)
-            
-            pdf.output(caminho_final)
-            conn.cursor().execute("INSERT INTO historico (data, info) VALUES (?, ?)", (txt_data.value, nome_arq))
-            conn.commit()
-            
-            page.snack_bar = ft.SnackBar(ft.Text(f"Salvo em: {caminho_final}"), bgcolor="green")
-            page.open(page.snack_bar)
-            page.update()
+            # Cópia do estado atual: o usuário pode continuar mexendo na tela
+            cab = {"data": txt_data.value, "lider": dd_lider.value, "turma": dd_turma.value,
+                   "maquina": dd_maquina.value, "rota": dd_rota.value}
+            itens = itens_execucao(banco.ler("SELECT id, titulo FROM rotina_itens ORDER BY ordem ASC, id ASC"),
+                                   rascunhos.copia(), fotos.por_secao(rascunhos.sessao), fotos)
         except Exception as ex:
             page.snack_bar = ft.SnackBar(ft.Text(f"Erro PDF: {ex}"), bgcolor="red")
             page.open(page.snack_bar)
+            return
+
+        # Hora e um sufixo aleatório no nome: duas rotas do mesmo dia e turma não se sobrescrevem
+        nome_arq = f"{cab['data'].replace('/', '_')}_{cab['turma']}_{datetime.datetime.now():%H%M%S}_{uuid.uuid4().hex[:4]}.pdf"
+        caminho_final = os.path.join(os.path.dirname(db_path), nome_arq)
+
+        cancelado = threading.Event()
+        barra = ft.ProgressBar(value=0, width=260)
+        dlg = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Gerando PDF..."),
+            content=barra,
+            actions=[ft.TextButton("Cancelar", on_click=lambda _: cancelado.set())]
+        )
+
+        def progresso(valor):
+            barra.value = valor
+            barra.update()
+
+        def worker():
+            try:
+                montar_relatorio(caminho_final, cab, itens, progresso, cancelado)
+                try:
+                    salvar_execucao(banco, cab, itens, nome_arq)
+                except Exception:
+                    # Sem linha no histórico o PDF ficaria órfão no disco
+                    try:
+                        os.remove(caminho_final)
+                    except OSError:
+                        pass
+                    raise
+                # Sobe para o coletor assim que der (sem rede fica no log local)
+                sincronizador.agendar()
+                page.snack_bar = ft.SnackBar(ft.Text(f"Salvo em: {caminho_final}"), bgcolor="green")
+            except RelatorioCancelado:
+                page.snack_bar = ft.SnackBar(ft.Text("Geração do PDF cancelada"), bgcolor="orange")
+            except Exception as ex:
+                page.snack_bar = ft.SnackBar(ft.Text(f"Erro PDF: {ex}"), bgcolor="red")
+            finally:
+                pdf_em_andamento.clear()
+            page.close(dlg)
+            page.open(page.snack_bar)
             page.update()
 
+        pdf_em_andamento.set()
+        page.open(dlg)
+        page.run_thread(worker)
+
     # --- ADMINISTRAÇÃO (COM DRAG & DROP E ABAS) ---
+    @medir_tela
     def show_admin(e=None):
         nonlocal current_nav_index
-        current_nav_index = 2
+        flush_drafts()
+        current_nav_index = 3
         page.clean()
-        page.navigation_bar.selected_index = 2
+        page.navigation_bar.selected_index = 3
         page.navigation_bar.visible = True
 
         novo_item_input = ft.TextField(label="Novo Item...", expand=True, border_radius=10)
@@ -259,75 +2149,297 @@ def main(page: ft.Page):
             ft.dropdown.Option("rotina", "Checklist")
         ], value="rotina")
 
+        # Colunas de cada aba e linhas por (tabela, id): as ações alteram só o necessário
+        listas = {}
+        linhas = {}
+
+        def atualizar_lista(tipo):
+            listas[tipo].update()
+
         def cadastrar(e):
             if not novo_item_input.value or not tipo_item_dd.value: return
-            local_c = conn.cursor()
-            if tipo_item_dd.value == "rotina":
-                res = local_c.execute("SELECT MAX(ordem) FROM rotina_itens").fetchone()
-                ordem = (res[0] or 0) + 1
-                local_c.execute("INSERT INTO rotina_itens (titulo, ordem) VALUES (?, ?)", (novo_item_input.value, ordem))
+            tipo = tipo_item_dd.value
+            nome = novo_item_input.value
+            if tipo == "rotina":
+                novo_id = banco.escrever(lambda c: c.execute(
+                    "INSERT INTO rotina_itens (titulo, ordem) VALUES (?, ?)", (nome, proxima_ordem(c))).lastrowid)
+                linha = criar_linha_rotina(novo_id, nome)
             else:
-                local_c.execute("INSERT INTO opcoes (tipo, nome) VALUES (?, ?)", (tipo_item_dd.value, novo_item_input.value))
-            conn.commit()
+                novo_id = banco.executar("INSERT INTO opcoes (tipo, nome) VALUES (?, ?)", (tipo, nome))
+                linha = criar_linha_opcao(novo_id, nome, tipo)
+                catalogo.invalidar()
+            listas[tipo].controls.append(linha)
             novo_item_input.value = ""
             page.snack_bar = ft.SnackBar(ft.Text("Item adicionado!"), bgcolor="green")
             page.open(page.snack_bar)
-            show_admin()
+            novo_item_input.update()
+            atualizar_lista(tipo)
 
-        def deletar(tabela, id_item):
-            conn.cursor().execute(f"DELETE FROM {tabela} WHERE id=?", (id_item,))
-            conn.commit()
-            show_admin()
+        def deletar(tabela, id_item, tipo):
+            banco.executar(f"DELETE FROM {tabela} WHERE id=?", (id_item,))
+            if tabela == "opcoes":
+                catalogo.invalidar()
+            linha = linhas.pop((tabela, id_item), None)
+            if linha in listas[tipo].controls:
+                listas[tipo].controls.remove(linha)
+                atualizar_lista(tipo)
 
         # Drag and Drop Logic
         def drag_accept(e):
             try:
-                src_id = int(e.data)
+                # Flet manda o id do controle arrastado em src_id; o id do item está no .data dele
+                origem = page.get_control(e.src_id) if getattr(e, "src_id", None) else None
+                src_id = int(origem.data) if origem is not None else int(e.data)
                 tgt_id = int(e.control.data)
-            except: return
+            except (TypeError, ValueError, AttributeError) as ex:
+                diagnostico.erro("drag_accept", ex)
+                return
             if src_id == tgt_id: return
             
-            local_c = conn.cursor()
-            rows = local_c.execute("SELECT id FROM rotina_itens ORDER BY ordem ASC").fetchall()
-            ids = [r[0] for r in rows]
-            
-            if src_id in ids and tgt_id in ids:
-                ids.remove(src_id)
-                insert_idx = ids.index(tgt_id)
-                ids.insert(insert_idx, src_id)
-                for idx, i_id in enumerate(ids):
-                    local_c.execute("UPDATE rotina_itens SET ordem = ? WHERE id = ?", (idx, i_id))
-                conn.commit()
-                show_admin()
+            if banco.escrever(lambda c: mover_item_rotina(c, src_id, tgt_id)):
+                mover_linha(src_id, tgt_id)
+
+        def mover_linha(src_id, tgt_id):
+            controles = listas["rotina"].controls
+            origem = linhas.get(("rotina_itens", src_id))
+            alvo = linhas.get(("rotina_itens", tgt_id))
+            if origem not in controles or alvo not in controles: return
+            controles.remove(origem)
+            controles.insert(controles.index(alvo), origem)
+            atualizar_lista("rotina")
+
+        def criar_linha_rotina(item_id, txt):
+            card = ft.Container(
+                content=ft.Row([
+                    ft.Icon(ft.Icons.DRAG_INDICATOR, color="grey"),
+                    ft.Text(txt, expand=True),
+                    ft.IconButton(ft.Icons.DELETE, icon_color="red", on_click=lambda e, i=item_id: deletar("rotina_itens", i, "rotina"))
+                ]),
+                bgcolor="white", padding=10, border_radius=8, border=ft.border.all(1, ft.Colors.GREY_200)
+            )
+            draggable = ft.Draggable(group="g", content=card, content_when_dragging=ft.Container(content=card, opacity=0.5), data=item_id)
+            target = LinhaChecklist(group="g", content=draggable, on_accept=drag_accept, data=item_id)
+            linhas[("rotina_itens", item_id)] = target
+            return target
+
+        def criar_linha_opcao(item_id, nome, tipo):
+            linha = ft.Container(
+                content=ft.Row([
+                    ft.Text(nome, expand=True),
+                    ft.IconButton(ft.Icons.DELETE, icon_color="red", on_click=lambda e, i=item_id: deletar("opcoes", i, tipo))
+                ]),
+                bgcolor="white", padding=10, border_radius=8, border=ft.border.all(1, ft.Colors.GREY_200)
+            )
+            linhas[("opcoes", item_id)] = linha
+            return linha
 
         def criar_lista(tipo):
+            col = ft.Column(spacing=5)
             if tipo == "rotina":
-                col = ft.Column(spacing=5)
-                for r in conn.cursor().execute("SELECT id, titulo FROM rotina_itens ORDER BY ordem ASC").fetchall():
-                    item_id, txt = r[0], r[1]
-                    card = ft.Container(
-                        content=ft.Row([
-                            ft.Icon(ft.Icons.DRAG_INDICATOR, color="grey"),
-                            ft.Text(txt, expand=True),
-                            ft.IconButton(ft.Icons.DELETE, icon_color="red", on_click=lambda e, i=item_id: deletar("rotina_itens", i))
-                        ]),
-                        bgcolor="white", padding=10, border_radius=8, border=ft.border.all(1, ft.Colors.GREY_200)
-                    )
-                    draggable = ft.Draggable(group="g", content=card, content_when_dragging=ft.Container(content=card, opacity=0.5), data=item_id)
-                    target = ft.DragTarget(group="g", content=draggable, on_accept=drag_accept, data=item_id)
-                    col.controls.append(target)
-                return col
+                for r in banco.ler("SELECT id, titulo FROM rotina_itens ORDER BY ordem ASC, id ASC"):
+                    col.controls.append(criar_linha_rotina(r[0], r[1]))
             else:
-                col = ft.Column(spacing=5)
-                for r in conn.cursor().execute(f"SELECT id, nome FROM opcoes WHERE tipo='{tipo}'").fetchall():
-                    col.controls.append(ft.Container(
-                        content=ft.Row([
-                            ft.Text(r[1], expand=True),
-                            ft.IconButton(ft.Icons.DELETE, icon_color="red", on_click=lambda e, i=r[0]: deletar("opcoes", i))
-                        ]),
-                        bgcolor="white", padding=10, border_radius=8, border=ft.border.all(1, ft.Colors.GREY_200)
-                    ))
-                return col
+                for item_id, nome in catalogo.itens(tipo):
+                    col.controls.append(criar_linha_opcao(item_id, nome, tipo))
+            listas[tipo] = col
+            return col
+
+        # Aba Diagnóstico: lê o instantâneo do processo, nada é medido aqui
+        painel_diag = ft.Column(spacing=4, scroll=ft.ScrollMode.AUTO, expand=True)
+
+        def linha_medida(m):
+            return ft.Column([
+                ft.Text(f"{m['quantidade']}x | méd {m['media_ms']:.1f} ms | máx {m['max_ms']:.1f} ms | total {m['total_ms']:.0f} ms", size=12, weight="w500"),
+                ft.Text(m["nome"], size=11, color="grey", font_family="monospace", max_lines=3),
+            ], spacing=0)
+
+        def montar_diagnostico():
+            dados = diagnostico.instantaneo()
+            medidas = dados["medidas"]
+            painel_diag.controls = [
+                ft.Row([
+                    ft.Switch(label="Medir", value=diagnostico.ativo, on_change=ligar_diagnostico),
+                    ft.IconButton(ft.Icons.REFRESH, tooltip="Atualizar", on_click=lambda _: atualizar_diagnostico()),
+                    ft.IconButton(ft.Icons.DELETE_SWEEP, tooltip="Zerar", on_click=lambda _: (diagnostico.zerar(), atualizar_diagnostico())),
+                    ft.IconButton(ft.Icons.SAVE_ALT, tooltip="Exportar JSON", on_click=exportar_diagnostico),
+                ], wrap=True),
+                ft.Text(f"Desde {data_br(dados['desde'][:10])} {dados['desde'][11:]}", size=12, color="grey"),
+                ft.Text("Consultas SQL (por tempo total)", weight="bold"),
+                *[linha_medida(m) for m in medidas if m["tipo"] == "sql"][:15],
+                ft.Text("Telas e updates", weight="bold"),
+                *[linha_medida(m) for m in medidas if m["tipo"] != "sql"][:15],
+                ft.Text("Controles por tela", weight="bold"),
+                *[ft.Text(f"{tela}: {n}", size=12) for tela, n in sorted(dados["arvores"].items())],
+                ft.Text(f"Operações lentas (>= {Diagnostico.LIMITE_LENTO_MS} ms) e erros", weight="bold"),
+                *[ft.Text(f"{l['quando'][11:]} {l['tipo']} {l['ms']:.0f} ms {l['nome']} {l.get('detalhe', '')}",
+                          size=11, color="red" if l["tipo"] == "erro" else None, max_lines=2)
+                  for l in reversed(dados["lentas"][-30:])],
+            ]
+            return painel_diag
+
+        def atualizar_diagnostico():
+            montar_diagnostico()
+            painel_diag.update()
+
+        def ligar_diagnostico(ev):
+            diagnostico.ativo = bool(ev.control.value)
+
+        def exportar_diagnostico(ev):
+            nome = f"diagnostico_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+            try:
+                caminho = diagnostico.exportar(os.path.join(os.path.dirname(db_path), nome))
+                page.snack_bar = ft.SnackBar(ft.Text(f"Salvo em: {caminho}"), bgcolor="green")
+            except Exception as ex:
+                page.snack_bar = ft.SnackBar(ft.Text(f"Erro ao exportar: {ex}"), bgcolor="red")
+            page.open(page.snack_bar)
+
+        # Importação / exportação do cadastro (CSV ou JSON)
+        def importar_arquivo(ev):
+            if not ev.files:
+                return
+            caminho = ev.files[0].path
+            if not caminho:
+                page.snack_bar = ft.SnackBar(ft.Text("Importação disponível só no app instalado"), bgcolor="red")
+                page.open(page.snack_bar)
+                return
+            try:
+                novos = importar_cadastro(banco, ler_cadastro(caminho))
+            except Exception as ex:
+                page.snack_bar = ft.SnackBar(ft.Text(f"Erro na importação: {ex}"), bgcolor="red")
+                page.open(page.snack_bar)
+                return
+            catalogo.invalidar()
+            # Uma única reconstrução da tela com tudo que entrou
+            show_admin()
+            resumo = ", ".join(f"{qtd} {tipo}" for tipo, qtd in novos.items()) or "nada novo"
+            page.snack_bar = ft.SnackBar(ft.Text(f"Importado: {resumo}"), bgcolor="green")
+            page.open(page.snack_bar)
+
+        def importar(ev):
+            pedido_arquivo["tratar"] = importar_arquivo
+            file_picker.pick_files(dialog_title="Importar cadastro", allowed_extensions=["csv", "json"])
+
+        def exportar(ev):
+            nome = f"cadastro_{datetime.datetime.now():%Y%m%d_%H%M%S}.csv"
+            try:
+                caminho = os.path.join(os.path.dirname(db_path), nome)
+                total = exportar_cadastro(banco, caminho)
+                page.snack_bar = ft.SnackBar(ft.Text(f"{total} itens salvos em: {caminho}"), bgcolor="green")
+            except Exception as ex:
+                page.snack_bar = ft.SnackBar(ft.Text(f"Erro ao exportar: {ex}"), bgcolor="red")
+            page.open(page.snack_bar)
+
+        # Aba Disco: uso por categoria e limites da manutenção
+        painel_disco = ft.Column(spacing=6, scroll=ft.ScrollMode.AUTO, expand=True)
+        retencao_input = ft.TextField(label="Retenção (dias, 0 = sem limite)", keyboard_type=ft.KeyboardType.NUMBER, border_radius=10, text_size=13)
+        limite_input = ft.TextField(label="Limite PDFs + fotos (MB, 0 = sem limite)", keyboard_type=ft.KeyboardType.NUMBER, border_radius=10, text_size=13)
+
+        def atualizar_disco():
+            uso = manutencao.uso()
+            retencao_input.value, limite_input.value = (str(v) for v in manutencao.limites())
+            linhas_uso = [
+                ("Banco de dados", uso["banco"]),
+                ("  espaço livre interno", uso["banco_livre"]),
+                ("Relatórios (PDF/ZIP)", uso["relatorios"]),
+                ("Fotos", uso["fotos"]),
+            ]
+            if uso["disco_livre"] is not None:
+                linhas_uso.append(("Livre no aparelho", uso["disco_livre"]))
+            painel_disco.controls = [
+                *[ft.Row([ft.Text(nome, expand=True), ft.Text(formatar_bytes(n), weight="w500")]) for nome, n in linhas_uso],
+                ft.Divider(),
+                retencao_input,
+                limite_input,
+                ft.Row([
+                    ft.ElevatedButton("Salvar limites", icon=ft.Icons.SAVE, on_click=salvar_limites),
+                    ft.OutlinedButton("Limpar agora", icon=ft.Icons.CLEANING_SERVICES, on_click=limpar_agora),
+                ], wrap=True),
+            ]
+            painel_disco.update()
+
+        def salvar_limites(ev):
+            try:
+                retencao, limite = int(retencao_input.value or 0), int(limite_input.value or 0)
+                if retencao < 0 or limite < 0:
+                    raise ValueError
+            except ValueError:
+                page.snack_bar = ft.SnackBar(ft.Text("Use números inteiros (0 = sem limite)"), bgcolor="red")
+                page.open(page.snack_bar)
+                return
+            salvar_configuracao(banco, "retencao_dias", retencao)
+            salvar_configuracao(banco, "limite_mb", limite)
+            page.snack_bar = ft.SnackBar(ft.Text("Limites salvos"), bgcolor="green")
+            page.open(page.snack_bar)
+
+        def limpar_agora(ev):
+            def worker():
+                try:
+                    r = manutencao.executar()
+                    page.snack_bar = ft.SnackBar(ft.Text(
+                        f"{r['relatorios']} relatórios, {r['fotos']} fotos e {r['rascunhos']} rascunhos removidos "
+                        f"({formatar_bytes(r['bytes'])})"), bgcolor="green")
+                except Exception as ex:
+                    page.snack_bar = ft.SnackBar(ft.Text(f"Erro na limpeza: {ex}"), bgcolor="red")
+                page.open(page.snack_bar)
+                if painel_disco.page:
+                    atualizar_disco()
+            page.run_thread(worker)
+
+        # Aba Sincronização: endereço do coletor e estado do envio
+        painel_sync = ft.Column(spacing=6, scroll=ft.ScrollMode.AUTO, expand=True)
+        url_input = ft.TextField(label="Endereço do coletor (http://...)", border_radius=10, text_size=13)
+
+        def atualizar_sync():
+            url_input.value = sincronizador.url()
+            ultimo = sincronizador.ultimo
+            if ultimo is None:
+                estado = "Ainda não sincronizado nesta execução"
+            elif ultimo["erro"]:
+                estado = f"{ultimo['quando'][11:]}: falhou ({ultimo['erro']})"
+            else:
+                estado = (f"{ultimo['quando'][11:]}: {ultimo['enviadas']} enviadas, {ultimo['recebidas']} recebidas, "
+                          f"{ultimo['fotos']} fotos em {ultimo['ms']} ms")
+            painel_sync.controls = [
+                url_input,
+                ft.Text(f"Aparelho: {sincronizador.dispositivo()[:8]}", size=12, color="grey"),
+                ft.Text(f"Alterações aguardando envio: {sincronizador.pendentes()}", size=13),
+                ft.Text(estado, size=12, color="red" if ultimo and ultimo["erro"] else None),
+                ft.Row([
+                    ft.ElevatedButton("Salvar", icon=ft.Icons.SAVE, on_click=salvar_url),
+                    ft.OutlinedButton("Sincronizar agora", icon=ft.Icons.SYNC, on_click=sincronizar_agora),
+                ], wrap=True),
+            ]
+            painel_sync.update()
+
+        def salvar_url(ev):
+            salvar_configuracao(banco, "coletor_url", (url_input.value or "").strip())
+            page.snack_bar = ft.SnackBar(ft.Text("Endereço salvo"), bgcolor="green")
+            page.open(page.snack_bar)
+
+        def sincronizar_agora(ev):
+            def worker():
+                try:
+                    r = sincronizador.sincronizar()
+                    page.snack_bar = ft.SnackBar(ft.Text(f"Sincronizado: {r['enviadas']} enviadas, {r['recebidas']} recebidas"), bgcolor="green")
+                except Exception as ex:
+                    page.snack_bar = ft.SnackBar(ft.Text(f"Erro na sincronização: {ex}"), bgcolor="red")
+                    r = None
+                if r and r["recebidas"]:
+                    # Checklist/opções vieram de outro aparelho: refaz a tela uma vez
+                    show_admin()
+                elif painel_sync.page:
+                    atualizar_sync()
+                page.open(page.snack_bar)
+            page.run_thread(worker)
+
+        def ao_trocar_aba(ev):
+            # Diagnóstico, disco e sincronização só são lidos quando a aba é aberta
+            if ev.control.selected_index == 5:
+                atualizar_diagnostico()
+            elif ev.control.selected_index == 6:
+                atualizar_disco()
+            elif ev.control.selected_index == 7:
+                atualizar_sync()
 
         tabs = ft.Tabs(
             selected_index=4, # Começa na rotina
@@ -338,7 +2450,11 @@ def main(page: ft.Page):
                 ft.Tab(text="Turma", content=criar_lista("turma")),
                 ft.Tab(text="Rota", content=criar_lista("rota")),
                 ft.Tab(text="Rotina", content=criar_lista("rotina")),
+                ft.Tab(text="Diag.", content=montar_diagnostico()),
+                ft.Tab(text="Disco", content=painel_disco),
+                ft.Tab(text="Sinc.", content=painel_sync),
             ],
+            on_change=ao_trocar_aba,
             expand=True
         )
 
@@ -347,6 +2463,10 @@ def main(page: ft.Page):
             ft.Container(content=ft.Column([
                 ft.Row([novo_item_input, tipo_item_dd]),
                 ft.ElevatedButton("Adicionar", on_click=cadastrar, width=page.width, style=ft.ButtonStyle(bgcolor=ft.Colors.PRIMARY, color="white")),
+                ft.Row([
+                    ft.OutlinedButton("Importar CSV/JSON", icon=ft.Icons.UPLOAD_FILE, on_click=importar, expand=True),
+                    ft.OutlinedButton("Exportar CSV", icon=ft.Icons.DOWNLOAD, on_click=exportar, expand=True),
+                ]),
                 ft.Divider(),
                 tabs
             ]), padding=20, expand=True)
@@ -367,19 +2487,26 @@ def main(page: ft.Page):
         page.open(dlg)
 
     # --- TELA DA ROTA (PRINCIPAL) ---
+    @medir_tela
     def show_rota(e=None):
-        nonlocal current_nav_index
+        nonlocal current_nav_index, versao_dropdowns
+        flush_drafts()
         current_nav_index = 1
         page.clean()
         page.navigation_bar.selected_index = 1
         page.navigation_bar.visible = True
 
         try:
-            c = conn.cursor()
-            dd_lider.options = [ft.dropdown.Option(r[0]) for r in c.execute("SELECT nome FROM opcoes WHERE tipo='lider'").fetchall()]
-            dd_maquina.options = [ft.dropdown.Option(r[0]) for r in c.execute("SELECT nome FROM opcoes WHERE tipo='maquina'").fetchall()]
-            dd_turma.options = [ft.dropdown.Option(r[0]) for r in c.execute("SELECT nome FROM opcoes WHERE tipo='turma'").fetchall()]
-            dd_rota.options = [ft.dropdown.Option(r[0]) for r in c.execute("SELECT nome FROM opcoes WHERE tipo='rota'").fetchall()]
+            # Um único SELECT no rascunho; daqui em diante tudo vem da memória
+            rascunhos.carregar()
+            # Opções vêm do catálogo em memória; só refaz os dropdowns se ele mudou
+            catalogo.carregar()
+            if versao_dropdowns != catalogo.versao:
+                dd_lider.options = [ft.dropdown.Option(n) for n in catalogo.nomes("lider")]
+                dd_maquina.options = [ft.dropdown.Option(n) for n in catalogo.nomes("maquina")]
+                dd_turma.options = [ft.dropdown.Option(n) for n in catalogo.nomes("turma")]
+                dd_rota.options = [ft.dropdown.Option(n) for n in catalogo.nomes("rota")]
+                versao_dropdowns = catalogo.versao
             
             # Recuperar valores
             dd_lider.value = get_draft("lider")
@@ -387,56 +2514,379 @@ def main(page: ft.Page):
             dd_turma.value = get_draft("turma")
             dd_rota.value = get_draft("rota")
 
-            lista_itens = ft.Column(spacing=15)
-            for r in c.execute("SELECT titulo FROM rotina_itens ORDER BY ordem ASC").fetchall():
-                t = r[0]
-                lista_itens.controls.append(ft.Container(
-                    content=ft.Column([
-                        ft.Row([ft.Icon(ft.Icons.CHECK_CIRCLE_OUTLINE, color="grey"), ft.Text(t, weight="w500", size=15)]),
-                        ft.Row([
-                            ft.IconButton(ft.Icons.CAMERA_ALT, icon_color=ft.Colors.PRIMARY, on_click=lambda e, x=t: (page.session.set("current_section", x), file_picker.pick_files(capture=True))),
-                            ft.TextField(hint_text="Obs...", expand=True, text_size=13, on_change=lambda e, x=t: save_draft(f"obs_{x}", e.control.value), value=get_draft(f"obs_{t}"))
-                        ])
-                    ]),
-                    bgcolor="white", padding=15, border_radius=10, border=ft.border.all(1, ft.Colors.GREY_200)
-                ))
+            # Só os títulos: as linhas (e o valor do rascunho) são montadas sob demanda
+            itens_rota = banco.ler("SELECT id, titulo FROM rotina_itens ORDER BY ordem ASC, id ASC")
+            fotos_secao = fotos.por_secao(rascunhos.sessao)
 
         except Exception as e:
             page.add(ft.Text(f"Erro rota: {e}", color="red"))
             return
 
         def limpar(e):
-            conn.cursor().execute("DELETE FROM rascunho")
-            conn.commit()
+            rascunhos.limpar()
+            fotos.limpar_rascunho(rascunhos.sessao)
             show_rota()
 
+        miniaturas.clear()
+
+        def criar_linha_item(item_id, t):
+            # Rascunho e fotos ficam ligados ao id do item, não ao título
+            secao = str(item_id)
+            mini = [criar_miniatura(fotos.caminho_miniatura(d)) for d in fotos_secao.get(secao, [])]
+            miniaturas[secao] = ft.Row(mini, wrap=True, visible=bool(mini))
+            return ft.Container(
+                content=ft.Column([
+                    ft.Row([ft.Icon(ft.Icons.CHECK_CIRCLE_OUTLINE, color="grey"), ft.Text(t, weight="w500", size=15)]),
+                    ft.Row([
+                        ft.IconButton(ft.Icons.CAMERA_ALT, icon_color=ft.Colors.PRIMARY, on_click=lambda e, x=secao: (page.session.set("current_section", x), file_picker.pick_files(capture=True))),
+                        ft.TextField(hint_text="Obs...", expand=True, text_size=13, on_change=lambda e, x=item_id: save_draft(f"obs_{x}", e.control.value), value=get_draft(f"obs_{item_id}"))
+                    ]),
+                    miniaturas[secao]
+                ]),
+                bgcolor="white", padding=15, border_radius=10, border=ft.border.all(1, ft.Colors.GREY_200),
+                margin=ft.margin.only(left=15, right=15, bottom=5)
+            )
+
+        rodape = [
+            ft.Container(content=ft.Column([
+                ft.ElevatedButton("Limpar", icon=ft.Icons.CLEANING_SERVICES, on_click=limpar, bgcolor=ft.Colors.RED_400, color="white", width=page.width),
+                ft.Container(height=10),
+                ft.ElevatedButton("Finalizar PDF", icon=ft.Icons.PICTURE_AS_PDF, on_click=gerar_pdf, bgcolor=ft.Colors.GREEN, color="white", width=page.width)
+            ]), padding=20),
+            ft.Container(height=80)
+        ]
+
+        # Lista virtualizada: o ListView só desenha o que está visível e as linhas
+        # do checklist são criadas em páginas conforme o usuário rola a tela
+        conteudo = ft.ListView(spacing=10, expand=True, on_scroll_interval=100, controls=[
+            criar_card("1. Identificação", ft.Column([txt_data, dd_lider, dd_maquina, dd_turma, dd_rota]), icone=ft.Icons.PERSON_SEARCH),
+            ft.Container(content=ft.Text("2. Checklist", weight="bold", size=16, color=ft.Colors.PRIMARY), padding=ft.padding.only(left=25)),
+            *rodape
+        ])
+        montados = 0
+        lock_pagina = threading.Lock()
+
+        def carregar_mais():
+            nonlocal montados
+            lote = itens_rota[montados:montados + PAGINA_CHECKLIST]
+            if not lote:
+                return False
+            pos = len(conteudo.controls) - len(rodape)
+            conteudo.controls[pos:pos] = [criar_linha_item(item_id, t) for item_id, t in lote]
+            montados += len(lote)
+            return True
+
+        def on_scroll(e):
+            if e.max_scroll_extent - e.pixels > 800 or montados >= len(itens_rota):
+                return
+            if not lock_pagina.acquire(blocking=False):
+                return
+            try:
+                if carregar_mais():
+                    conteudo.update()
+            finally:
+                lock_pagina.release()
+
+        conteudo.on_scroll = on_scroll
+        carregar_mais()
+
         page.add(
             ft.Container(
                 content=ft.Row([ft.Text("Nova Rota", size=20, weight="bold"), ft.Icon(ft.Icons.ASSIGNMENT, color=ft.Colors.PRIMARY)], alignment="spaceBetween"),
                 padding=ft.padding.only(left=20, right=20, top=40, bottom=10), bgcolor="white"
             ),
-            ft.Column([
-                criar_card("1. Identificação", ft.Column([txt_data, dd_lider, dd_maquina, dd_turma, dd_rota]), icone=ft.Icons.PERSON_SEARCH),
-                ft.Container(content=ft.Text("2. Checklist", weight="bold", size=16, color=ft.Colors.PRIMARY), padding=ft.padding.only(left=25)),
-                ft.Container(content=lista_itens, padding=ft.padding.only(left=15, right=15)),
-                ft.Container(content=ft.Column([
-                    ft.ElevatedButton("Limpar", icon=ft.Icons.CLEANING_SERVICES, on_click=limpar, bgcolor=ft.Colors.RED_400, color="white", width=page.width),
-                    ft.Container(height=10),
-                    ft.ElevatedButton("Finalizar PDF", icon=ft.Icons.PICTURE_AS_PDF, on_click=gerar_pdf, bgcolor=ft.Colors.GREEN, color="white", width=page.width)
-                ]), padding=20),
-                ft.Container(height=80)
-            ], scroll="auto", expand=True)
+            conteudo
+        )
+        page.update()
+
+    # --- HISTÓRICO (PAGINADO) ---
+    def abrir_relatorio(info, execucao_id):
+        caminho = os.path.join(os.path.dirname(db_path), info)
+        if os.path.exists(caminho):
+            page.snack_bar = ft.SnackBar(ft.Text(f"Arquivo: {caminho}"), bgcolor="green")
+            page.open(page.snack_bar)
+            return
+        if not execucao_id or not fpdf_disponivel():
+            page.snack_bar = ft.SnackBar(ft.Text("Arquivo não encontrado"), bgcolor="red")
+            page.open(page.snack_bar)
+            return
+
+        # PDF apagado: regera a partir da execução salva no banco
+        def regerar():
+            try:
+                cab, itens = carregar_execucao(banco, execucao_id, fotos)
+                montar_relatorio(caminho, cab, itens)
+                page.snack_bar = ft.SnackBar(ft.Text(f"Regerado em: {caminho}"), bgcolor="green")
+            except Exception as ex:
+                page.snack_bar = ft.SnackBar(ft.Text(f"Erro PDF: {ex}"), bgcolor="red")
+            page.open(page.snack_bar)
+        page.run_thread(regerar)
+
+    @medir_tela
+    def show_historico(e=None):
+        nonlocal current_nav_index
+        flush_drafts()
+        current_nav_index = 2
+        page.clean()
+        page.navigation_bar.selected_index = 2
+        page.navigation_bar.visible = True
+
+        filtros = {"inicio": None, "fim": None, "turma": None, "maquina": None}
+        proxima = None
+        carregando = threading.Lock()
+
+        txt_inicio = ft.TextField(label="De", read_only=True, expand=True, border_radius=10, text_size=13)
+        txt_fim = ft.TextField(label="Até", read_only=True, expand=True, border_radius=10, text_size=13)
+        dd_filtro_turma = ft.Dropdown(label="Turma", expand=True, border_radius=10,
+                                      options=[ft.dropdown.Option("", "Todas")] + [ft.dropdown.Option(n) for n in catalogo.nomes("turma")])
+        dd_filtro_maquina = ft.Dropdown(label="Máquina", expand=True, border_radius=10,
+                                        options=[ft.dropdown.Option("", "Todas")] + [ft.dropdown.Option(n) for n in catalogo.nomes("maquina")])
+        lista = ft.ListView(spacing=8, expand=True, padding=ft.padding.only(left=15, right=15, bottom=80), on_scroll_interval=100)
+
+        def escolher_data(campo, chave):
+            def ao_escolher(ev):
+                if seletor_historico.value:
+                    campo.value = seletor_historico.value.strftime("%d/%m/%Y")
+                    filtros[chave] = seletor_historico.value.date().isoformat()
+                    recarregar()
+            seletor_historico.on_change = ao_escolher
+            page.open(seletor_historico)
+
+        txt_inicio.on_focus = lambda _: escolher_data(txt_inicio, "inicio")
+        txt_fim.on_focus = lambda _: escolher_data(txt_fim, "fim")
+
+        def limpar_datas(ev):
+            if not (filtros["inicio"] or filtros["fim"]):
+                return
+            txt_inicio.value = txt_fim.value = ""
+            filtros["inicio"] = filtros["fim"] = None
+            recarregar()
+        bt_limpar_datas = ft.IconButton(ft.Icons.EVENT_BUSY, tooltip="Todas as datas", on_click=limpar_datas)
+
+        def mudar_turma(ev):
+            filtros["turma"] = dd_filtro_turma.value or None
+            recarregar()
+        dd_filtro_turma.on_change = mudar_turma
+
+        def mudar_maquina(ev):
+            filtros["maquina"] = dd_filtro_maquina.value or None
+            recarregar()
+        dd_filtro_maquina.on_change = mudar_maquina
+
+        def criar_linha(hist_id, data, turma, info, execucao_id):
+            return ft.Container(
+                content=ft.Row([
+                    ft.Icon(ft.Icons.PICTURE_AS_PDF, color=ft.Colors.PRIMARY),
+                    ft.Column([ft.Text(info, weight="w500", size=14), ft.Text(f"{data_br(data)} | Turma: {turma or '-'}", size=12, color="grey")],
+                              spacing=2, expand=True),
+                ]),
+                bgcolor="white", padding=12, border_radius=10, border=ft.border.all(1, ft.Colors.GREY_200),
+                on_click=lambda _, i=info, x=execucao_id: abrir_relatorio(i, x)
+            )
+
+        def carregar_pagina(apos):
+            nonlocal proxima
+            linhas, proxima = pagina_historico(banco, apos, filtros["inicio"], filtros["fim"], filtros["turma"],
+                                             PAGINA_HISTORICO, filtros["maquina"])
+            lista.controls.extend(criar_linha(*r) for r in linhas)
+            if not lista.controls:
+                lista.controls.append(ft.Text("Nenhum relatório encontrado.", color="grey"))
+
+        def recarregar():
+            with carregando:
+                lista.controls.clear()
+                carregar_pagina(None)
+            page.update()
+
+        def on_scroll(ev):
+            if proxima is None or ev.max_scroll_extent - ev.pixels > 600:
+                return
+            if not carregando.acquire(blocking=False):
+                return
+            try:
+                if proxima is not None:
+                    carregar_pagina(proxima)
+                    lista.update()
+            finally:
+                carregando.release()
+        lista.on_scroll = on_scroll
+
+        # Exporta de uma vez todas as rotas que os filtros atuais mostram
+        def exportar(ev, formato):
+            page.close(dlg_exportar)
+            if not fpdf_disponivel():
+                page.snack_bar = ft.SnackBar(ft.Text("Erro: Biblioteca FPDF ausente"), bgcolor="red")
+                page.open(page.snack_bar)
+                return
+            if pdf_em_andamento.is_set():
+                return
+            ids = ids_execucoes(banco, filtros["inicio"], filtros["fim"], filtros["turma"], filtros["maquina"])
+            if not ids:
+                page.snack_bar = ft.SnackBar(ft.Text("Nenhuma rota salva no período"), bgcolor="orange")
+                page.open(page.snack_bar)
+                return
+            if formato == "pdf" and len(ids) > LOTE_PDF_MAX:
+                page.snack_bar = ft.SnackBar(ft.Text(f"{len(ids)} rotas: o PDF único vai até {LOTE_PDF_MAX}. Use o ZIP."), bgcolor="orange")
+                page.open(page.snack_bar)
+                return
+            periodo = f"{filtros['inicio'] or 'inicio'}_{filtros['fim'] or 'hoje'}"
+            # Horário no nome: exportar o mesmo período de novo não sobrescreve o arquivo anterior
+            destino = os.path.join(os.path.dirname(db_path),
+                                   f"lote_{periodo}_{datetime.datetime.now():%Y%m%d_%H%M%S}.{formato}")
+
+            cancelado = threading.Event()
+            barra = ft.ProgressBar(value=0, width=260)
+            dlg = ft.AlertDialog(
+                modal=True,
+                title=ft.Text(f"Exportando {len(ids)} rotas..."),
+                content=barra,
+                actions=[ft.TextButton("Cancelar", on_click=lambda _: cancelado.set())]
+            )
+
+            def progresso(valor):
+                barra.value = valor
+                barra.update()
+
+            def worker():
+                try:
+                    exportar_lote(banco, fotos, ids, destino, formato, progresso, cancelado)
+                    page.snack_bar = ft.SnackBar(ft.Text(f"Salvo em: {destino}"), bgcolor="green")
+                except RelatorioCancelado:
+                    page.snack_bar = ft.SnackBar(ft.Text("Exportação cancelada"), bgcolor="orange")
+                except Exception as ex:
+                    page.snack_bar = ft.SnackBar(ft.Text(f"Erro exportação: {ex}"), bgcolor="red")
+                finally:
+                    pdf_em_andamento.clear()
+                page.close(dlg)
+                page.open(page.snack_bar)
+                page.update()
+
+            pdf_em_andamento.set()
+            page.open(dlg)
+            page.run_thread(worker)
+
+        dlg_exportar = ft.AlertDialog(
+            title=ft.Text("Exportar rotas do filtro"),
+            content=ft.Text(f"Um PDF com todas as rotas (até {LOTE_PDF_MAX}) ou um ZIP com um PDF por rota?"),
+            actions=[ft.TextButton("PDF único", on_click=lambda ev: exportar(ev, "pdf")),
+                     ft.TextButton("ZIP", on_click=lambda ev: exportar(ev, "zip"))]
+        )
+
+        carregar_pagina(None)
+        page.add(
+            ft.Container(
+                content=ft.Row([ft.Text("Histórico", size=20, weight="bold"),
+                                ft.Row([
+                                    ft.IconButton(ft.Icons.DOWNLOAD, icon_color=ft.Colors.PRIMARY, tooltip="Exportar em lote", on_click=lambda _: page.open(dlg_exportar)),
+                                    ft.IconButton(ft.Icons.SEARCH, icon_color=ft.Colors.PRIMARY, tooltip="Buscar observações", on_click=show_busca)
+                                ], spacing=0)],
+                               alignment="spaceBetween"),
+                padding=ft.padding.only(left=20, right=20, top=40, bottom=10), bgcolor="white"
+            ),
+            ft.Container(content=ft.Column([ft.Row([txt_inicio, txt_fim, bt_limpar_datas]), ft.Row([dd_filtro_turma, dd_filtro_maquina])]),
+                         padding=ft.padding.only(left=15, right=15, top=10, bottom=10)),
+            lista
+        )
+        page.update()
+
+    # --- BUSCA NAS OBSERVAÇÕES (FTS5) ---
+    @medir_tela
+    def show_busca(e=None):
+        nonlocal current_nav_index
+        flush_drafts()
+        current_nav_index = 2
+        page.clean()
+        page.navigation_bar.selected_index = 2
+        page.navigation_bar.visible = True
+
+        resultados = ft.ListView(spacing=8, expand=True, padding=ft.padding.only(left=15, right=15, bottom=80))
+        resumo = ft.Text("", size=12, color="grey")
+
+        def buscar(ev=None):
+            texto = campo.value or ""
+            resultados.controls.clear()
+            if len(texto.strip()) >= 3:
+                t0 = time.perf_counter()
+                linhas = buscar_observacoes(banco, texto)
+                resumo.value = f"{len(linhas)} resultado(s) em {(time.perf_counter() - t0) * 1000:.0f} ms"
+                for execucao_id, data, maquina, turma, arquivo, titulo, trecho in linhas:
+                    resultados.controls.append(ft.Container(
+                        content=ft.Column([
+                            ft.Text(titulo, weight="w500", size=14),
+                            ft.Text(trecho or "", size=13),
+                            ft.Text(f"{data_br(data)} | Máquina: {maquina or '-'} | Turma: {turma or '-'}", size=12, color="grey"),
+                        ], spacing=2),
+                        bgcolor="white", padding=12, border_radius=10, border=ft.border.all(1, ft.Colors.GREY_200),
+                        on_click=lambda _, a=arquivo, x=execucao_id: abrir_relatorio(a, x)
+                    ))
+            else:
+                resumo.value = ""
+            page.update()
+
+        campo = ft.TextField(hint_text="Ex.: vazamento, rolamento...", prefix_icon=ft.Icons.SEARCH, border_radius=10,
+                             autofocus=True, on_change=buscar, on_submit=buscar)
+
+        page.add(
+            ft.Container(
+                content=ft.Row([ft.IconButton(ft.Icons.ARROW_BACK, on_click=show_historico), ft.Text("Buscar observações", size=20, weight="bold")]),
+                padding=ft.padding.only(left=10, right=20, top=40, bottom=10), bgcolor="white"
+            ),
+            ft.Container(content=ft.Column([campo, resumo]), padding=ft.padding.only(left=15, right=15, top=10, bottom=10)),
+            resultados
         )
         page.update()
 
     # --- MENU INICIAL ---
+    @medir_tela
     def show_menu():
         nonlocal current_nav_index
+        flush_drafts()
         current_nav_index = 0
         page.clean()
         page.navigation_bar.selected_index = 0
         page.navigation_bar.visible = True
-        
+
+        # Painel de indicadores: só lê resumo_dia/resumo_item (poucas linhas por dia)
+        painel = ft.Column(spacing=0)
+
+        def numero(titulo, valor, cor=ft.Colors.PRIMARY):
+            return ft.Container(content=ft.Column([ft.Text(valor, size=22, weight="bold", color=cor), ft.Text(titulo, size=12, color="grey")],
+                                                  spacing=2, horizontal_alignment="center"), expand=True)
+
+        def lista_ranking(titulo, linhas, unidade="rotas", vazio="Sem observações no período"):
+            return ft.Column([
+                ft.Text(titulo, weight="bold", size=14),
+                *([ft.Row([ft.Text(nome or "-", expand=True, size=13, max_lines=1), ft.Text(f"{obs} obs. em {total} {unidade}", size=12, color="grey")])
+                   for nome, obs, total in linhas] or [ft.Text(vazio, size=12, color="grey")]),
+            ], spacing=4)
+
+        def montar_painel(meses):
+            dados = indicadores(banco, inicio_periodo(meses))
+            pct = f"{100 * dados['itens_com_obs'] / dados['itens']:.0f}%" if dados["itens"] else "-"
+            painel.controls = [criar_card("Indicadores", ft.Column([
+                ft.SegmentedButton(selected={str(meses)}, on_change=trocar_periodo, segments=[
+                    ft.Segment(value="1", label=ft.Text("Este mês")), ft.Segment(value="12", label=ft.Text("12 meses"))]),
+                ft.Row([numero("Rotas", str(dados["rotas"])), numero("Itens verificados", str(dados["itens"])),
+                        numero("Com observação", pct, ft.Colors.ORANGE)]),
+                ft.Divider(),
+                lista_ranking("Máquinas com mais observações", dados["maquinas"]),
+                ft.Divider(),
+                lista_ranking("Itens mais apontados", dados["itens_apontados"], "verificações"),
+                ft.Divider(),
+                lista_ranking("Por turma", dados["turmas"]),
+                ft.Divider(),
+                lista_ranking("Por líder", dados["lideres"]),
+            ], spacing=8), icone=ft.Icons.INSIGHTS)]
+
+        def trocar_periodo(ev):
+            montar_painel(int(next(iter(ev.control.selected))))
+            painel.update()
+
+        try:
+            montar_painel(1)
+        except Exception as ex:
+            painel.controls = [ft.Text(f"Erro indicadores: {ex}", color="red")]
+
         page.add(
             ft.Column([
                 ft.Container(
@@ -449,8 +2899,10 @@ def main(page: ft.Page):
                                  bgcolor="white", padding=20, border_radius=20, on_click=lambda _: show_rota(), expand=True, shadow=ft.BoxShadow(blur_radius=10, color=ft.Colors.GREY_200)),
                     ft.Container(content=ft.Column([ft.Icon(ft.Icons.SETTINGS, size=50, color=ft.Colors.ORANGE), ft.Text("Config", weight="bold")]), 
                                  bgcolor="white", padding=20, border_radius=20, on_click=lambda _: check_admin_pass(), expand=True, shadow=ft.BoxShadow(blur_radius=10, color=ft.Colors.GREY_200))
-                ], spacing=20), padding=20, margin=ft.margin.only(top=-20))
-            ])
+                ], spacing=20), padding=20, margin=ft.margin.only(top=-20)),
+                painel,
+                ft.Container(height=80)
+            ], scroll=ft.ScrollMode.AUTO, expand=True)
         )
         page.update()
 
@@ -459,12 +2911,14 @@ def main(page: ft.Page):
         idx = e.control.selected_index
         if idx == 0: show_menu()
         elif idx == 1: show_rota()
-        elif idx == 2: check_admin_pass()
+        elif idx == 2: show_historico()
+        elif idx == 3: check_admin_pass()
 
     page.navigation_bar = ft.NavigationBar(
         destinations=[
             ft.NavigationBarDestination(icon=ft.Icons.HOME, label="Início"),
             ft.NavigationBarDestination(icon=ft.Icons.ASSIGNMENT, label="Rota"),
+            ft.NavigationBarDestination(icon=ft.Icons.HISTORY, label="Histórico"),
             ft.NavigationBarDestination(icon=ft.Icons.ADMIN_PANEL_SETTINGS, label="Admin"),
         ],
         on_change=on_nav,
@@ -473,6 +2927,7 @@ def main(page: ft.Page):
         elevation=10
     )
 
+    @medir_tela
     def show_login():
         page.clean()
         page.navigation_bar.visible = False
@@ -498,5 +2953,10 @@ def main(page: ft.Page):
 
     # Início do Fluxo Principal (Após carregamento seguro)
     show_login()
+    registrar_inicio(banco, (time.perf_counter() - t_inicio) * 1000)
 
-ft.app(target=main)
+if __name__ == "__main__":
+    if MODO_SERVIDOR:
+        ft.app(target=main, view=ft.AppView.WEB_BROWSER, port=int(os.environ.get("FITESA_PORTA", "8550")))
+    else:
+        ft.app(target=main)
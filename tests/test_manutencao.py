@@ -0,0 +1,74 @@
+"""Manutenção do armazenamento: compactação do banco e o que pode (ou não) ser apagado."""
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from PIL import Image
+
+import main as app
+
+
+class TestManutencao(unittest.TestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        caminho = os.path.join(self.pasta, "fitesa_rotas.db")
+        conexao = sqlite3.connect(caminho, isolation_level=None)
+        try:
+            app.migrar(conexao)
+        finally:
+            conexao.close()
+        self.banco = app.BancoSQLite(caminho)
+        self.fotos = app.FotoStore(self.banco)
+        # Ociosidade enorme: só as rodadas chamadas pelo teste
+        self.manutencao = app.Manutencao(self.banco, self.fotos, ocioso=10 ** 9)
+
+    def tearDown(self):
+        self.manutencao.fechar()
+        self.fotos.fechar()
+        self.banco.fechar()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def foto(self, secao, cor):
+        origem = os.path.join(self.pasta, f"origem_{secao}.jpg")
+        Image.new("RGB", (640, 480), cor).save(origem)
+        self.fotos.adicionar("", secao, origem).result()
+        return self.banco.ler_um("SELECT hash FROM rascunho_fotos WHERE secao = ?", (secao,))[0]
+
+    def test_compactar_devolve_as_paginas_livres(self):
+        self.manutencao.executar()  # primeira rodada liga o auto_vacuum incremental
+        self.banco.escrever(lambda c: c.execute("CREATE TABLE lastro (dados BLOB)"))
+        self.banco.escrever(lambda c: c.executemany("INSERT INTO lastro VALUES (randomblob(4000))", [()] * 1500))
+        self.banco.escrever(lambda c: c.execute("DROP TABLE lastro"))
+        self.banco.escrever(lambda c: c.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone(), transacao=False)
+        livres = self.banco.ler_um("PRAGMA freelist_count")[0]
+        tamanho = os.path.getsize(self.banco.caminho)
+        self.assertGreater(livres, 1000)
+
+        self.manutencao.executar()
+        self.assertLessEqual(self.banco.ler_um("PRAGMA freelist_count")[0], max(0, livres - app.VACUUM_PAGINAS))
+        self.assertLess(os.path.getsize(self.banco.caminho), tamanho // 2)
+
+    def test_foto_de_rota_salva_nunca_sai(self):
+        usada, solta = self.foto("1", (200, 10, 10)), self.foto("2", (10, 200, 10))
+        cab = {"data": "01/01/2020", "lider": "L", "turma": "T", "maquina": "M", "rota": "R"}
+        app.salvar_execucao(self.banco, cab, [{"item_id": 1, "titulo": "Item 1", "obs": "", "hashes": [usada]}], "r.pdf")
+        self.fotos.limpar_rascunho("")
+        # Antigas e acima de qualquer limite: retenção e limite de disco no máximo
+        antiga = (datetime.datetime.now() - datetime.timedelta(days=3650)).isoformat(timespec="seconds")
+        self.banco.escrever(lambda c: c.execute("UPDATE fotos SET criado_em = ?", (antiga,)))
+        app.salvar_configuracao(self.banco, "retencao_dias", 1)
+        app.salvar_configuracao(self.banco, "limite_mb", 1)
+
+        resumo = self.manutencao.executar()
+        self.assertEqual(resumo["fotos"], 1)
+        self.assertTrue(os.path.exists(self.fotos.caminho(usada)))
+        self.assertTrue(os.path.exists(self.fotos.caminho_miniatura(usada)))
+        self.assertIsNotNone(self.banco.ler_um("SELECT 1 FROM fotos WHERE hash = ?", (usada,)))
+        self.assertFalse(os.path.exists(self.fotos.caminho(solta)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Ranks com intervalo do checklist: mover grava uma linha, renumera só sem folga."""
+import sqlite3
+import unittest
+
+import main as app
+
+
+class TestOrdem(unittest.TestCase):
+    def setUp(self):
+        self.c = sqlite3.connect(":memory:", isolation_level=None)
+        app.migrar(self.c)
+        for titulo in "ABCDE":
+            self.c.execute("INSERT INTO rotina_itens (titulo, ordem) VALUES (?, ?)", (titulo, app.proxima_ordem(self.c)))
+
+    def id(self, titulo):
+        return self.c.execute("SELECT id FROM rotina_itens WHERE titulo = ?", (titulo,)).fetchone()[0]
+
+    def titulos(self):
+        return "".join(r[0] for r in self.c.execute("SELECT titulo FROM rotina_itens ORDER BY ordem, id"))
+
+    def ranks(self):
+        return dict(self.c.execute("SELECT titulo, ordem FROM rotina_itens"))
+
+    def mover(self, origem, destino):
+        antes = self.ranks()
+        self.assertTrue(app.mover_item_rotina(self.c, self.id(origem), self.id(destino)))
+        return {t for t, ordem in self.ranks().items() if antes[t] != ordem}
+
+    def test_mover_para_o_inicio(self):
+        self.assertEqual(self.mover("E", "A"), {"E"})
+        self.assertEqual(self.titulos(), "EABCD")
+
+    def test_mover_para_o_meio(self):
+        self.assertEqual(self.mover("A", "D"), {"A"})
+        self.assertEqual(self.titulos(), "BCADE")
+
+    def test_mover_para_o_fim(self):
+        self.assertEqual(self.mover("A", "E"), {"A"})
+        self.assertEqual(self.titulos(), "BCDAE")
+
+    def test_sem_folga_renumera(self):
+        # Sempre no mesmo intervalo: a folga de ORDEM_PASSO acaba em ~log2(ORDEM_PASSO) movimentos
+        ordem, alterados = list("ABCDE"), []
+        for n in range(12):
+            origem = "ED"[n % 2]
+            ordem.remove(origem)
+            ordem.insert(ordem.index("C"), origem)
+            alterados.append(len(self.mover(origem, "C")))
+            self.assertEqual(self.titulos(), "".join(ordem))
+        # Uma linha por movimento, até a renumeração (a única que mexe em várias)
+        renumeracao = next(n for n, qtd in enumerate(alterados) if qtd > 1)
+        self.assertEqual(alterados[:renumeracao], [1] * renumeracao)
+        self.assertGreaterEqual(renumeracao, 5)
+        ranks = sorted(self.ranks().values())
+        self.assertEqual(len(set(ranks)), len(ranks))
+
+    def test_rebalancear_ordem(self):
+        self.c.execute("UPDATE rotina_itens SET ordem = 7")
+        app.rebalancear_ordem(self.c)
+        self.assertEqual(sorted(self.ranks().values()), [(i + 1) * app.ORDEM_PASSO for i in range(5)])
+        self.assertEqual(self.titulos(), "ABCDE")
+
+    def test_vizinho_usa_o_indice(self):
+        plano = " ".join(r[3] for r in self.c.execute(
+            "EXPLAIN QUERY PLAN SELECT ordem FROM rotina_itens WHERE (ordem, id) < (?, ?) AND id <> ? "
+            "ORDER BY ordem DESC, id DESC LIMIT 1", (1, 1, 1)))
+        self.assertIn("idx_rotina_ordem", plano)
+        self.assertNotIn("TEMP B-TREE", plano)
+
+
+if __name__ == "__main__":
+    unittest.main()
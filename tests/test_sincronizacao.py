@@ -0,0 +1,236 @@
+"""Dois tablets sincronizando por um coletor de verdade (HTTP local, porta livre)."""
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import coletor
+import main as app
+
+
+class Tablet:
+    def __init__(self, pasta, url=None):
+        os.makedirs(pasta)
+        caminho = os.path.join(pasta, "fitesa_rotas.db")
+        conexao = sqlite3.connect(caminho, isolation_level=None)
+        try:
+            app.migrar(conexao)
+        finally:
+            conexao.close()
+        self.banco = app.BancoSQLite(caminho)
+        self.fotos = app.FotoStore(self.banco)
+        self.sincronizador = app.Sincronizador(self.banco, self.fotos, intervalo=3600)
+        if url:
+            app.salvar_configuracao(self.banco, "coletor_url", url)
+
+    def checklist(self):
+        return self.banco.ler("SELECT titulo, ordem, uid FROM rotina_itens ORDER BY ordem, id")
+
+    def opcoes(self):
+        return self.banco.ler("SELECT tipo, nome, uid FROM opcoes ORDER BY tipo, nome")
+
+    def id_item(self, titulo):
+        return self.banco.ler_um("SELECT id FROM rotina_itens WHERE titulo = ?", (titulo,))[0]
+
+    def fechar(self):
+        self.sincronizador.fechar()
+        self.fotos.fechar()
+        self.banco.fechar()
+
+
+class TestSincronizacao(unittest.TestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.servidor = coletor.criar_servidor(os.path.join(self.pasta, "coletor"), 0, "127.0.0.1")
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        self.a = Tablet(os.path.join(self.pasta, "a"), url)
+        self.b = Tablet(os.path.join(self.pasta, "b"), url)
+
+    def tearDown(self):
+        self.a.fechar()
+        self.b.fechar()
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def rodadas(self, n=3):
+        for _ in range(n):
+            self.a.sincronizador.sincronizar()
+            self.b.sincronizador.sincronizar()
+
+    def test_configuracao_converge(self):
+        app.importar_cadastro(self.a.banco, [("lider", "Ana"), ("rotina", "Item 1"), ("rotina", "Item 2"), ("rotina", "Item 3")])
+        # Mesmo item digitado à mão no outro tablet: vira o mesmo registro, não um duplicado
+        app.importar_cadastro(self.b.banco, [("rotina", "item 2"), ("lider", "Zé")])
+        self.rodadas()
+        self.assertEqual(self.a.checklist(), self.b.checklist())
+        self.assertEqual(len(self.a.checklist()), 3)
+        self.assertEqual(self.a.opcoes(), self.b.opcoes())
+
+        # Alterações concorrentes: A move um item, B apaga outro
+        self.a.banco.escrever(lambda c: app.mover_item_rotina(c, self.a.id_item("Item 3"), self.a.id_item("Item 1")))
+        item_1 = self.b.id_item("Item 1")
+        self.b.banco.escrever(lambda c: c.execute("DELETE FROM rotina_itens WHERE id = ?", (item_1,)))
+        self.rodadas()
+        titulos = [t for t, _, _ in self.a.checklist()]
+        self.assertNotIn("Item 1", titulos)
+        self.assertEqual(len(titulos), 2)
+        self.assertEqual(self.a.checklist(), self.b.checklist())
+        self.assertEqual(self.a.sincronizador.pendentes(), 0)
+        self.assertEqual(self.b.sincronizador.pendentes(), 0)
+
+    def test_rota_finalizada_so_sobe(self):
+        cab = {"data": "01/02/2026", "lider": "Ana", "turma": "T1", "maquina": "M1", "rota": "R1"}
+        app.salvar_execucao(self.a.banco, cab, [{"item_id": 1, "titulo": "Item 1", "obs": "ok", "hashes": []}], "a.pdf")
+        self.rodadas(1)
+        status = self.a.sincronizador._requisicao("/status")
+        self.assertEqual(status["registros"].get("execucoes"), 1)
+        self.assertEqual(self.b.banco.ler_um("SELECT COUNT(*) FROM execucoes")[0], 0)
+
+
+class TestCompactacaoLog(unittest.TestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.t = Tablet(os.path.join(self.pasta, "t"))
+
+    def tearDown(self):
+        self.t.fechar()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def log(self):
+        return self.t.banco.ler("SELECT tabela, operacao, remoto FROM alteracoes ORDER BY seq")
+
+    def test_sem_coletor_o_log_nao_cresce(self):
+        app.importar_cadastro(self.t.banco, [("rotina", "Item 1"), ("rotina", "Item 2")])
+        item_1, item_2 = self.t.id_item("Item 1"), self.t.id_item("Item 2")
+        for n in range(20):
+            self.t.banco.escrever(lambda c, n=n: c.execute("UPDATE rotina_itens SET titulo = ? WHERE id = ?", (f"Item 1.{n}", item_1)))
+        self.t.banco.escrever(lambda c: c.execute("DELETE FROM rotina_itens WHERE id = ?", (item_2,)))
+        self.assertEqual(len(self.log()), 23)
+        self.t.banco.escrever(app.compactar_alteracoes)
+        # Nada foi trocado com um coletor: a lápide não protege nada e sai junto
+        self.assertEqual(self.log(), [("rotina_itens", "gravar", 0)])
+
+    def test_lapides_enviadas_saem_depois_do_prazo(self):
+        app.importar_cadastro(self.t.banco, [("rotina", "Item 1"), ("rotina", "Item 2")])
+        item_1 = self.t.id_item("Item 1")
+        self.t.banco.escrever(lambda c: c.execute("DELETE FROM rotina_itens WHERE id = ?", (item_1,)))
+        enviado = self.t.banco.ler_um("SELECT MAX(seq) FROM alteracoes")[0]
+        app.salvar_configuracao(self.t.banco, "sync_enviado", enviado)
+        self.t.banco.escrever(app.compactar_alteracoes)
+        self.assertIn(("rotina_itens", "apagar", 0), self.log())
+        self.t.banco.escrever(lambda c: app.compactar_alteracoes(c, dias_lapide=-1))
+        self.assertNotIn(("rotina_itens", "apagar", 0), self.log())
+
+
+class TestAplicarAlteracoes(unittest.TestCase):
+    """Regras de conflito de aplicar_alteracoes, direto no banco (sem HTTP)."""
+
+    UID_A, UID_B = "0" * 32, "f" * 32
+    ANTES, AGORA, DEPOIS = "2026-01-01T10:00:00.000", "2026-01-01T11:00:00.000", "2026-01-01T12:00:00.000"
+
+    def setUp(self):
+        self.c = sqlite3.connect(":memory:", isolation_level=None)
+        app.migrar(self.c)
+
+    def local(self, tabela, uid, quando, **campos):
+        colunas = ", ".join(campos)
+        self.c.execute(f"INSERT INTO {tabela} ({colunas}) VALUES ({', '.join('?' * len(campos))})", tuple(campos.values()))
+        self.c.execute(f"UPDATE {tabela} SET uid = ?, alterado_em = ? WHERE id = last_insert_rowid()", (uid, quando))
+        self.c.execute("DELETE FROM alteracoes")
+
+    def aplicar(self, *alteracoes):
+        return app.aplicar_alteracoes(self.c, [
+            {"tabela": t, "uid": u, "operacao": o, "alterado_em": q, "dados": d} for t, u, o, q, d in alteracoes])
+
+    def opcao(self, uid):
+        return self.c.execute("SELECT tipo, nome, alterado_em FROM opcoes WHERE uid = ?", (uid,)).fetchone()
+
+    def item(self, uid):
+        return self.c.execute("SELECT titulo, ordem FROM rotina_itens WHERE uid = ?", (uid,)).fetchone()
+
+    def log_local(self):
+        return self.c.execute("SELECT tabela, uid, operacao FROM alteracoes WHERE remoto = 0 ORDER BY seq").fetchall()
+
+    def test_mais_recente_vence_em_opcoes(self):
+        self.local("opcoes", self.UID_A, self.AGORA, tipo="lider", nome="Ana")
+        self.aplicar(("opcoes", self.UID_A, "gravar", self.ANTES, {"tipo": "lider", "nome": "Ana Antiga"}))
+        self.assertEqual(self.opcao(self.UID_A), ("lider", "Ana", self.AGORA))
+        self.aplicar(("opcoes", self.UID_A, "gravar", self.DEPOIS, {"tipo": "lider", "nome": "Ana Paula"}))
+        self.assertEqual(self.opcao(self.UID_A), ("lider", "Ana Paula", self.DEPOIS))
+        # O que veio de fora não volta para o log local
+        self.assertEqual(self.log_local(), [])
+
+    def test_mais_recente_vence_no_checklist(self):
+        self.local("rotina_itens", self.UID_A, self.AGORA, titulo="Item 1", ordem=1024)
+        self.aplicar(("rotina_itens", self.UID_A, "gravar", self.ANTES, {"titulo": "Item velho", "ordem": 4096}))
+        self.assertEqual(self.item(self.UID_A), ("Item 1", 1024))
+        self.assertEqual(self.aplicar(("rotina_itens", self.UID_A, "gravar", self.DEPOIS, {"titulo": "Item 1", "ordem": 2048})),
+                         [self.UID_A])
+        self.assertEqual(self.item(self.UID_A), ("Item 1", 2048))
+
+    def test_empate_decidido_pelo_conteudo(self):
+        self.local("opcoes", self.UID_A, self.AGORA, tipo="turma", nome="B")
+        self.aplicar(("opcoes", self.UID_A, "gravar", self.AGORA, {"tipo": "turma", "nome": "A"}))
+        self.assertEqual(self.opcao(self.UID_A)[1], "B")
+        self.aplicar(("opcoes", self.UID_A, "gravar", self.AGORA, {"tipo": "turma", "nome": "C"}))
+        self.assertEqual(self.opcao(self.UID_A)[1], "C")
+
+    def test_apagar_mais_novo_remove(self):
+        self.local("opcoes", self.UID_A, self.AGORA, tipo="maquina", nome="M1")
+        self.aplicar(("opcoes", self.UID_A, "apagar", self.DEPOIS, None))
+        self.assertIsNone(self.opcao(self.UID_A))
+        lapide = self.c.execute("SELECT operacao, alterado_em, remoto FROM alteracoes WHERE uid = ?", (self.UID_A,)).fetchall()
+        self.assertEqual(lapide, [("apagar", self.DEPOIS, 1)])
+
+    def test_apagar_mais_velho_nao_remove(self):
+        self.local("opcoes", self.UID_A, self.AGORA, tipo="maquina", nome="M1")
+        self.aplicar(("opcoes", self.UID_A, "apagar", self.ANTES, None))
+        self.assertEqual(self.opcao(self.UID_A)[1], "M1")
+
+    def test_lapide_impede_volta_de_versao_antiga(self):
+        self.aplicar(("rotina_itens", self.UID_A, "apagar", self.AGORA, None))
+        self.aplicar(("rotina_itens", self.UID_A, "gravar", self.ANTES, {"titulo": "Item 1", "ordem": 1024}))
+        self.assertIsNone(self.item(self.UID_A))
+        self.aplicar(("rotina_itens", self.UID_A, "gravar", self.AGORA, {"titulo": "Item 1", "ordem": 1024}))
+        self.assertIsNone(self.item(self.UID_A))
+        # Recriado depois da lápide: volta
+        self.aplicar(("rotina_itens", self.UID_A, "gravar", self.DEPOIS, {"titulo": "Item 1", "ordem": 1024}))
+        self.assertEqual(self.item(self.UID_A), ("Item 1", 1024))
+
+    def test_apagado_localmente_e_registrado(self):
+        self.local("rotina_itens", self.UID_A, self.AGORA, titulo="Item 1", ordem=1024)
+        self.c.execute("DELETE FROM rotina_itens WHERE uid = ?", (self.UID_A,))
+        self.assertEqual(self.log_local(), [("rotina_itens", self.UID_A, "apagar")])
+
+    def test_mesmo_nome_adota_o_menor_uid(self):
+        self.local("opcoes", self.UID_B, self.AGORA, tipo="lider", nome="ana")
+        self.aplicar(("opcoes", self.UID_A, "gravar", self.DEPOIS, {"tipo": "lider", "nome": "Ana"}))
+        self.assertEqual(self.c.execute("SELECT uid, nome FROM opcoes").fetchall(), [(self.UID_A, "Ana")])
+
+    def test_mesmo_nome_com_uid_maior_espera_o_outro_adotar(self):
+        self.local("opcoes", self.UID_A, self.AGORA, tipo="lider", nome="ana")
+        self.aplicar(("opcoes", self.UID_B, "gravar", self.DEPOIS, {"tipo": "lider", "nome": "Ana"}))
+        self.assertEqual(self.c.execute("SELECT uid, nome FROM opcoes").fetchall(), [(self.UID_A, "ana")])
+
+    def test_adocao_com_versao_local_mais_nova_sobe_de_novo(self):
+        self.local("rotina_itens", self.UID_B, self.DEPOIS, titulo="Item 2", ordem=1024)
+        self.aplicar(("rotina_itens", self.UID_A, "gravar", self.ANTES, {"titulo": "item 2", "ordem": 4096}))
+        self.assertEqual(self.item(self.UID_A), ("Item 2", 1024))
+        self.assertEqual(self.log_local(), [("rotina_itens", self.UID_A, "gravar")])
+
+    def test_empate_de_rank_empurra_o_maior_uid(self):
+        self.local("rotina_itens", self.UID_A, self.AGORA, titulo="Item 1", ordem=1024)
+        self.local("rotina_itens", self.UID_B, self.AGORA, titulo="Item 2", ordem=2048)
+        self.aplicar(("rotina_itens", self.UID_B, "gravar", self.DEPOIS, {"titulo": "Item 2", "ordem": 1024}))
+        self.assertEqual(self.item(self.UID_A), ("Item 1", 1024))
+        self.assertGreater(self.item(self.UID_B)[1], 1024)
+        # O ajuste é alteração local: os outros aparelhos recebem o mesmo rank
+        self.assertEqual(self.log_local(), [("rotina_itens", self.UID_B, "gravar")])
+
+
+if __name__ == "__main__":
+    unittest.main()